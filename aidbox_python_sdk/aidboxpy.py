@@ -1,4 +1,6 @@
 # type: ignore because fhir-py is not typed properly
+import json
+import time
 from abc import ABC
 
 from fhirpy.base import (
@@ -14,6 +16,9 @@ from fhirpy.base import (
 from fhirpy.base.resource import BaseReference, BaseResource
 from fhirpy.base.searchset import AbstractSearchSet
 
+from . import metrics
+from .tracing import current_span, tracer
+
 __title__ = "aidbox-py"
 __version__ = "1.3.0"
 __author__ = "beda.software"
@@ -127,6 +132,29 @@ class SyncAidboxClient(SyncClient):
 
 
 class AsyncAidboxClient(AsyncClient):
+    async def _do_request(self, method, path, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            with tracer.start_span(
+                "aidbox.request", attributes={"http.method": method.upper(), "http.path": path}
+            ) as span:
+                result = await super()._do_request(method, path, *args, **kwargs)
+                if tracer.enabled:
+                    data = result[0] if kwargs.get("returning_status") else result
+                    span.set_attribute("http.response_size", _json_size(data))
+                return result
+        finally:
+            metrics.aidbox_request_duration.observe(
+                time.perf_counter() - started_at, method.upper()
+            )
+
+    def _build_request_headers(self):
+        headers = super()._build_request_headers()
+        span = current_span()
+        if span is not None:
+            headers["traceparent"] = span.traceparent
+        return headers
+
     def resource(self, resource_type, **kwargs):
         return AsyncAidboxResource(self, resource_type, **kwargs)
          
@@ -142,3 +170,11 @@ class AsyncAidboxClient(AsyncClient):
         if not resource_type and not id:
             raise TypeError("Arguments `resource_type` and `id` or `reference`are required")
         return AsyncAidboxReference(self, resourceType=resource_type, id=id, **kwargs)
+
+
+def _json_size(data):
+    # The response body is read and decoded inside fhirpy,
+    # so the size is of the compactly encoded result
+    if data is None:
+        return 0
+    return len(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode())
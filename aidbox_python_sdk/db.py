@@ -1,5 +1,10 @@
+import asyncio
+import contextvars
 import json
 import logging
+import random
+import time
+from contextlib import contextmanager
 from typing import Optional
 
 from aiohttp import BasicAuth, ClientSession
@@ -12,19 +17,44 @@ from sqlalchemy import (
     Table,
     Text,
     TypeDecorator,
+    case,
+    cast,
+    func,
+    select,
     text,
+    tuple_,
 )
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.dialects.postgresql import array as postgresql_array
 from sqlalchemy.dialects.postgresql import dialect as postgresql_dialect
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.postgresql.base import PGDialect
 from sqlalchemy.sql.elements import ClauseElement
 
+try:
+    from sqlalchemy.engine.interfaces import BindTyping
+except ImportError:
+    # SQLAlchemy < 2.0, parameterized queries aren't supported
+    BindTyping = None
+
 from aidbox_python_sdk.settings import Settings
 
+from . import metrics
+from .db_asyncpg import DB_BACKENDS, AsyncpgBackend
+from .db_batch import DBBatch
+from .db_columnar import collect_columns, get_typecodes
+from .db_stream import iter_psql_rows, iter_sql_rows
 from .exceptions import AidboxDBException
+from .json_codec import get_json_codec
+from .slow_queries import SlowQueryLog, is_read_query, is_read_statement
+from .statement_cache import ParameterizedStatementCache, StatementCache
+from .tracing import current_span, tracer
 
 logger = logging.getLogger("aidbox_sdk.db")
 table_metadata = MetaData()
 
+_read_your_writes = contextvars.ContextVar("aidbox_sdk_read_your_writes", default=False)
+
 
 class AidboxPostgresqlDialect(postgresql_dialect):
     # We don't need escaping at this level
@@ -32,12 +62,32 @@ class AidboxPostgresqlDialect(postgresql_dialect):
     _backslash_escapes = False
 
 
+def create_parameterized_dialect(json_serializer, paramstyle="qmark"):
+    """
+    Driver-independent dialect that compiles statements for `$sql`
+    with `?` placeholders (or for asyncpg with `$1` placeholders, "numeric_dollar")
+    and explicit casts of parameters (requires SQLAlchemy 2.0+)
+    """
+    if BindTyping is None:
+        raise ImportError(
+            "Parameterized queries (and asyncpg backend) require SQLAlchemy 2.0+, "
+            "install it with `pip install 'SQLAlchemy>=2.0'`"
+        )
+
+    class AidboxParameterizedDialect(PGDialect):
+        bind_typing = BindTyping.RENDER_CASTS
+
+    return AidboxParameterizedDialect(json_serializer=json_serializer, paramstyle=paramstyle)
+
+
 class _JSONB(TypeDecorator):
     impl = JSONB
+    cache_ok = True
 
     def process_literal_param(self, value, dialect):
         if isinstance(value, dict):
-            return "'{}'".format(json.dumps(value).replace("'", "''"))
+            json_serializer = dialect._json_serializer or json.dumps
+            return "'{}'".format(json_serializer(value).replace("'", "''"))
         if isinstance(value, str):
             return value
         raise ValueError(f"Don't know how to literal-quote value of type {type(value)}")
@@ -45,6 +95,7 @@ class _JSONB(TypeDecorator):
 
 class _ARRAY(TypeDecorator):
     impl = ARRAY
+    cache_ok = True
 
     def process_literal_param(self, value, dialect):
         if isinstance(value, list):
@@ -54,8 +105,43 @@ class _ARRAY(TypeDecorator):
         raise ValueError(f"Don't know how to literal-quote value of type {type(value)}")
 
 
+class ResourceTable(Table):
+    """
+    Table of resources with helpers to build queries
+    """
+
+    inherit_cache = True
+
+    def project(self, *paths, **aliased_paths):
+        """
+        Returns SELECT of `id` and only the given elements of the resource,
+        so the rows are compact: `{"id": ..., "name": [...], "birthDate": ...}`.
+        A path is a top-level element (extracted by `->`) or dot-separated
+        path (extracted by `#>`) that is also the name of the column
+        unless it's passed as a keyword argument:
+
+            db.Patient.project("name", "birthDate", city="address.0.city").where(...)
+        """
+        if not paths and not aliased_paths:
+            raise ValueError("At least one path is required")
+        columns = [self.c.id]
+        for name, path in [*((path, path) for path in paths), *aliased_paths.items()]:
+            if not isinstance(path, str) or not path:
+                raise ValueError("Path must be a non-empty str")
+            elements = path.split(".")
+            if len(elements) == 1:
+                element = self.c.resource[path]
+            else:
+                # JSON path of SQLAlchemy is a '{a, 0, b}' str parameter that isn't
+                # accepted by asyncpg as text[], so the path is an explicit array
+                path_array = cast(postgresql_array(elements), ARRAY(Text))
+                element = self.c.resource.op("#>", return_type=self.c.resource.type)(path_array)
+            columns.append(element.label(name))
+        return select(*columns)
+
+
 def create_table(table_name):
-    return Table(
+    return ResourceTable(
         table_name,
         table_metadata,
         Column("id", Text, primary_key=True),
@@ -81,17 +167,59 @@ class DBProxy:
     def __init__(self, settings: Settings, _table_cache: Optional[dict] = None):
         self._settings = settings
         self._table_cache = _table_cache or {}
+        self._json_codec = get_json_codec(settings.JSON_CODEC)
+        if settings.DB_BACKEND not in DB_BACKENDS:
+            raise ValueError(f"DB_BACKEND must be one of {', '.join(DB_BACKENDS)}")
+        self._backend = None
+        if settings.DB_BACKEND == "asyncpg":
+            self._backend = AsyncpgBackend(
+                settings.DB_DSN,
+                json_codec=self._json_codec,
+                min_size=settings.DB_POOL_MIN_SIZE,
+                max_size=settings.DB_POOL_MAX_SIZE,
+                statement_cache_size=settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+            )
+        self._replica_backend = None
+        if self._backend is not None and settings.DB_REPLICA_DSN:
+            self._replica_backend = AsyncpgBackend(
+                settings.DB_REPLICA_DSN,
+                json_codec=self._json_codec,
+                min_size=settings.DB_POOL_MIN_SIZE,
+                max_size=settings.DB_POOL_MAX_SIZE,
+                statement_cache_size=settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+            )
+        self._statement_cache = StatementCache(
+            AidboxPostgresqlDialect(json_serializer=self._json_codec.dumps),
+            max_size=settings.DB_STATEMENT_CACHE_SIZE,
+        )
+        self._parameterized_statement_cache = None
+        if settings.DB_PARAMETERIZED_QUERIES or self._backend is not None:
+            # Fails early if parameterized queries aren't supported
+            self._parameterized_statement_cache = self._create_parameterized_statement_cache()
+        self._slow_query_log = SlowQueryLog(top_n=settings.DB_SLOW_QUERIES_TOP_N)
+        self._explain_tasks = {}
 
     async def initialize(self):
         basic_auth = BasicAuth(
             login=self._settings.APP_INIT_CLIENT_ID,
             password=self._settings.APP_INIT_CLIENT_SECRET,
         )
-        self._client = ClientSession(auth=basic_auth)
+        self._client = ClientSession(auth=basic_auth, json_serialize=self._json_codec.dumps)
+        if self._backend is not None:
+            await self._backend.initialize()
+        if self._replica_backend is not None:
+            await self._replica_backend.initialize()
         if not self._table_cache:
             await self._init_table_cache()
 
     async def deinitialize(self):
+        for task in list(self._explain_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._explain_tasks.values(), return_exceptions=True)
+        if self._backend is not None:
+            await self._backend.deinitialize()
+        if self._replica_backend is not None:
+            await self._replica_backend.deinitialize()
         await self._client.close()
 
     def clone(self) -> "DBProxy":
@@ -102,47 +230,547 @@ class DBProxy:
 
         return DBProxy(self._settings, _table_cache=self._table_cache)
 
-    async def raw_sql(self, sql_query, *, execute=False):
+    async def raw_sql(self, sql_query, *, execute=False, params=None, read_only=None):
         """
         Executes SQL query and returns result. Specify `execute` to True
         if you want to execute `sql_query` that doesn't return result
         (for example, UPDATE without returning or CREATE INDEX and etc.)
         otherwise you'll get an AidboxDBException
+
+        If `params` list is passed, `sql_query` with `?` placeholders is executed
+        via `$sql` with these parameters (`execute` is not needed).
+        With asyncpg backend (`DB_BACKEND`) placeholders are `$1`, `$2`, etc.
+
+        If the replica is configured (`DB_REPLICA_URL`/`DB_REPLICA_DSN`), the query
+        is executed on the replica only if `read_only` is True (SQL text might have
+        side effects, for example, `SELECT nextval(...)`), queries with `execute`
+        always go to the primary
         """
         if not self._client:
             raise ValueError("Client not set")
         if not isinstance(sql_query, str):
             raise ValueError("sql_query must be a str")
+        if params is not None and not isinstance(params, (list, tuple)):
+            raise ValueError("params must be a list")
         if not execute and sql_query.count(";") > 1:
             logger.warning("Check that your query does not contain two queries separated by `;`")
-        query_url = f"{self._settings.APP_INIT_URL}/$psql"
+        replica = self._route_to_replica(execute=execute, read_only=read_only)
+        return await self._execute_query(sql_query, execute=execute, params=params, replica=replica)
+
+    @property
+    def has_replica(self):
+        if self._backend is not None:
+            return self._replica_backend is not None
+        return bool(self._settings.DB_REPLICA_URL)
+
+    @contextmanager
+    def read_your_writes(self):
+        """
+        Routes all queries of the block (and of tasks created in it) to the primary,
+        so reads see the preceding writes regardless of the replication lag
+
+            await db.alchemy(update(...), execute=True)
+            with db.read_your_writes():
+                await db.alchemy(select(...))
+        """
+        token = _read_your_writes.set(True)
+        try:
+            yield
+        finally:
+            _read_your_writes.reset(token)
+
+    def _route_to_replica(self, *, execute, read_only):
+        return bool(read_only and not execute and self.has_replica and not _read_your_writes.get())
+
+    def batch(self, *, transaction=False):
+        """
+        Returns DBBatch to execute several statements in a single request:
+
+            async with db.batch() as batch:
+                patients = batch.alchemy(select(db.Patient))
+                practitioners = batch.alchemy(select(db.Practitioner))
+            batch.results[patients].get()
+
+        Transactional batches (`transaction=True`) require asyncpg backend
+        """
+        if not self._client:
+            raise ValueError("Client not set")
+        if transaction and self._backend is None:
+            # Every $psql request might be executed on a different connection of Aidbox pool,
+            # so a failed transaction can't be reliably rolled back
+            raise ValueError("Transactional batches are supported only by asyncpg backend")
+        return DBBatch(self, transaction=transaction)
+
+    async def _execute_batch(self, statements, *, execute, read_only, transaction):
+        """
+        Executes statements with their `execute` and `read_only` flags and returns
+        a `$psql` result (or None if it's not executed) per statement
+        """
+        # The batch is executed on the replica only if all its statements are reads
+        replica = not transaction and all(
+            self._route_to_replica(execute=statement_execute, read_only=statement_read_only)
+            for statement_execute, statement_read_only in zip(execute, read_only)
+        )
+        if self._backend is not None:
+            backend = self._replica_backend if replica else self._backend
+            run = backend.fetch_batch(statements, execute=execute, transaction=transaction)
+            return await self._measure(
+                ";\n".join(statements), run, execute=any(execute), batch=True, replica=replica
+            )
+
+        # $psql request has a single `execute` flag
+        if len(set(execute)) > 1:
+            raise ValueError(
+                "Statements with and without `execute` can't be mixed in a batch executed via $psql"
+            )
+        execute = execute[0]
+        sql_query = ";\n".join(statements)
+        run = self._psql_results(sql_query, execute=execute, replica=replica)
+        return await self._measure(sql_query, run, execute=execute, batch=True, replica=replica)
+
+    async def _execute_query(self, sql_query, *, execute=False, params=None, replica=False):
+        run = self._run_query(sql_query, execute=execute, params=params, replica=replica)
+        return await self._measure(sql_query, run, execute=execute, params=params, replica=replica)
+
+    def _run_query(self, sql_query, *, execute, params, replica):
+        if self._backend is not None:
+            backend = self._replica_backend if replica else self._backend
+            return backend.fetch(sql_query, params or (), execute=execute)
+        if params is not None:
+            return self._sql(sql_query, params, replica=replica)
+        return self._psql(sql_query, execute=execute, replica=replica)
+
+    async def _measure(  # noqa: PLR0913
+        self, sql_query, run, *, execute, params=None, batch=False, replica=False
+    ):
+        started_at = time.perf_counter()
+        try:
+            with tracer.start_span(
+                "db.batch" if batch else "db.query",
+                attributes={
+                    "db.statement_size": len(sql_query),
+                    "db.execute": execute,
+                    "db.replica": replica,
+                },
+            ):
+                result = await run
+        except Exception:
+            metrics.db_query_errors.inc()
+            raise
+        finally:
+            duration = time.perf_counter() - started_at
+            metrics.db_query_duration.observe(duration)
+        threshold = self._settings.DB_SLOW_QUERY_THRESHOLD
+        if threshold and duration >= threshold:
+            self._log_slow_query(
+                sql_query,
+                duration,
+                len(result) if isinstance(result, list) else None,
+                # Statements of the batch are not explained
+                execute=execute or batch,
+                params=params,
+                replica=replica,
+            )
+        return result
+
+    def slow_queries(self):
+        """
+        Returns the worst slow statements (see `DB_SLOW_QUERY_THRESHOLD`)
+        sorted by the max duration with their EXPLAIN plans if they are captured
+        """
+        return self._slow_query_log.top()
+
+    def reset_slow_queries(self):
+        self._slow_query_log.reset()
+
+    def _log_slow_query(  # noqa: PLR0913
+        self, sql_query, duration, rows, *, execute, params, replica
+    ):
+        logger.warning("Slow query (%.3fs, %s rows):\n%s", duration, rows, sql_query)
+        entry = self._slow_query_log.record(sql_query, duration, rows)
+        if entry is None:
+            return
+        template = entry["query"]
+        if (
+            not execute
+            and template not in self._explain_tasks
+            and random.random() < self._settings.DB_SLOW_QUERY_EXPLAIN_RATE
+            and is_read_query(sql_query)
+        ):
+            task = asyncio.create_task(self._explain(sql_query, template, params, replica))
+            self._explain_tasks[template] = task
+            task.add_done_callback(lambda _: self._explain_tasks.pop(template, None))
+
+    async def _explain(self, sql_query, template, params, replica):
+        # The plan is captured where the query was executed
+        explain_query = f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql_query}"
+        try:
+            result = await self._run_query(
+                explain_query, execute=False, params=params, replica=replica
+            )
+        except Exception:
+            logger.exception("Failed to explain slow query:\n%s", sql_query)
+            return
+        plan = result[0]["QUERY PLAN"] if result else None
+        logger.info("Plan of slow query:\n%s\n%s", sql_query, self._json_codec.dumps(plan))
+        self._slow_query_log.set_plan(template, plan)
+
+    def _base_url(self, replica):
+        return self._settings.DB_REPLICA_URL if replica else self._settings.APP_INIT_URL
+
+    async def _psql(self, sql_query, *, execute, replica=False):
+        results = await self._psql_results(sql_query, execute=execute, replica=replica)
+        if results[0]["status"] == "error":
+            raise AidboxDBException(results[0])
+        return results[0].get("result", None)
+
+    async def _psql_results(self, sql_query, *, execute, replica=False):
+        query_url = f"{self._base_url(replica)}/$psql"
+        span = current_span()
         async with self._client.post(
             query_url,
             json={"query": sql_query},
             params={"execute": "true"} if execute else {},
+            headers={"traceparent": span.traceparent} if span else None,
             raise_for_status=True,
         ) as resp:
-            logger.debug("$psql answer %s", await resp.text())
-            results = await resp.json()
+            body = await resp.read()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("$psql answer %s", body.decode())
+            if span is not None:
+                span.set_attribute("db.response_size", len(body))
+            return self._json_codec.loads(body)
+
+    async def _sql(self, sql_query, params, *, replica=False):
+        query_url = f"{self._base_url(replica)}/$sql"
+        span = current_span()
+        async with self._client.post(
+            query_url,
+            json=[sql_query, *params],
+            headers={"traceparent": span.traceparent} if span else None,
+        ) as resp:
+            body = await resp.read()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("$sql answer %s", body.decode())
+            if span is not None:
+                span.set_attribute("db.response_size", len(body))
+            results = self._json_codec.loads(body)
 
-            if results[0]["status"] == "error":
-                raise AidboxDBException(results[0])
-            return results[0].get("result", None)
+            if resp.status >= 400:
+                raise AidboxDBException(results)
+            return results
 
     def compile_statement(self, statement):
-        return str(
-            statement.compile(
-                dialect=AidboxPostgresqlDialect(),
-                compile_kwargs={"literal_binds": True},
-            )
+        return self._statement_cache.compile(statement)
+
+    def compile_parameterized_statement(self, statement):
+        """
+        Returns the statement with `?` placeholders (`$1` for asyncpg backend)
+        and the list of its parameters
+        """
+        return self._get_parameterized_statement_cache().compile(statement)
+
+    def _get_parameterized_statement_cache(self):
+        if self._parameterized_statement_cache is None:
+            self._parameterized_statement_cache = self._create_parameterized_statement_cache()
+        return self._parameterized_statement_cache
+
+    def _create_parameterized_statement_cache(self):
+        is_asyncpg = self._backend is not None
+        return ParameterizedStatementCache(
+            create_parameterized_dialect(
+                self._json_codec.dumps,
+                paramstyle="numeric_dollar" if is_asyncpg else "qmark",
+            ),
+            max_size=self._settings.DB_STATEMENT_CACHE_SIZE,
+            # asyncpg encodes python values (datetime, Decimal, etc.) itself
+            json_values=not is_asyncpg,
         )
 
-    async def alchemy(self, statement, *, execute=False):
+    def statement_cache_stats(self):
+        return self._statement_cache.stats()
+
+    async def alchemy(
+        self, statement, *, execute=False, parameterized=None, read_only=None, columnar=False
+    ):
+        """
+        Executes SQLAlchemy statement. The statement is compiled with literal values
+        and executed via `$psql` or, if `parameterized` is True (default is
+        `settings.DB_PARAMETERIZED_QUERIES`), it's compiled with `?` placeholders
+        and executed with separate parameters via `$sql`.
+        With asyncpg backend statements are parameterized by default
+        to reuse prepared statements.
+        If the replica is configured, SELECT statements (except `with_for_update()`)
+        are executed on the replica, pass `read_only` True or False to route
+        the statement explicitly (see `raw_sql`)
+
+        If `columnar` is True, the result is a dict of columns instead of rows:
+        numpy arrays (if numpy is installed) or `array`/list with the type
+        inferred from the column type of the statement:
+
+            {"status": array(["created", ...], dtype=object), "count_1": array([10, ...])}
+        """
         if not isinstance(statement, ClauseElement):
             raise ValueError("statement must be a sqlalchemy expression")
+        if parameterized is None:
+            parameterized = self._settings.DB_PARAMETERIZED_QUERIES or self._backend is not None
+        if read_only is None:
+            read_only = is_read_statement(statement)
+        if columnar:
+            if execute:
+                raise ValueError("columnar result requires a statement that returns rows")
+            # Types of the result columns are taken from the cached compiled statement
+            if parameterized:
+                cache = self._get_parameterized_statement_cache()
+                query, params, columns = cache.compile_with_columns(statement)
+            else:
+                query, columns = self._statement_cache.compile_with_columns(statement)
+                params = None
+            # Rows are collected into columns as they are received
+            rows = self.stream(query, params=params, read_only=read_only)
+            try:
+                return await collect_columns(rows, get_typecodes(columns))
+            finally:
+                await rows.aclose()
+        if parameterized:
+            query, params = self.compile_parameterized_statement(statement)
+            logger.debug("Built query:\n%s\nParams: %s", query, params)
+            return await self.raw_sql(query, params=params, read_only=read_only)
         query = self.compile_statement(statement)
         logger.debug("Built query:\n%s", query)
-        return await self.raw_sql(query, execute=execute)
+        return await self.raw_sql(query, execute=execute, read_only=read_only)
+
+    async def stream(
+        self, query, *, params=None, parameterized=None, read_only=None, chunk_size=65536
+    ):
+        """
+        Executes the query (SQL string or SQLAlchemy statement) and yields rows
+        as they are received: `$psql` (`$sql` for parameterized queries) response
+        is decoded incrementally by `chunk_size` bytes, so the whole response is never
+        kept in memory. With asyncpg backend rows are fetched by a cursor
+
+            async for row in db.stream(select(db.Observation).where(...)):
+                ...
+
+        See `raw_sql` and `alchemy` for the other arguments
+        """
+        if not self._client:
+            raise ValueError("Client not set")
+        sql_query, params, read_only = self._prepare_stream_query(
+            query, params=params, parameterized=parameterized, read_only=read_only
+        )
+        replica = self._route_to_replica(execute=False, read_only=read_only)
+        if self._backend is not None:
+            backend = self._replica_backend if replica else self._backend
+            rows = backend.stream(sql_query, params or ())
+        else:
+            rows = self._stream_rows(sql_query, params, replica=replica, chunk_size=chunk_size)
+        # Only waiting for rows is measured, not the processing of yielded rows
+        duration = 0.0
+        rows_count = 0
+        try:
+            while True:
+                started_at = time.perf_counter()
+                try:
+                    row = await rows.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    duration += time.perf_counter() - started_at
+                rows_count += 1
+                yield row
+        except Exception:
+            metrics.db_query_errors.inc()
+            raise
+        finally:
+            # Releases the connection if the iteration is stopped
+            started_at = time.perf_counter()
+            await rows.aclose()
+            duration += time.perf_counter() - started_at
+            metrics.db_query_duration.observe(duration)
+        threshold = self._settings.DB_SLOW_QUERY_THRESHOLD
+        if threshold and duration >= threshold:
+            self._log_slow_query(
+                sql_query, duration, rows_count, execute=False, params=params, replica=replica
+            )
+
+    def _prepare_stream_query(self, query, *, params, parameterized, read_only):
+        if isinstance(query, str):
+            if params is not None and not isinstance(params, (list, tuple)):
+                raise ValueError("params must be a list")
+            return query, params, read_only
+        if not isinstance(query, ClauseElement):
+            raise ValueError("query must be a str or sqlalchemy expression")
+        if params is not None:
+            raise ValueError("params can't be passed with sqlalchemy statement")
+        if read_only is None:
+            read_only = is_read_statement(query)
+        if parameterized is None:
+            parameterized = self._settings.DB_PARAMETERIZED_QUERIES or self._backend is not None
+        if parameterized:
+            sql_query, params = self.compile_parameterized_statement(query)
+            return sql_query, params, read_only
+        return self.compile_statement(query), None, read_only
+
+    async def _stream_rows(self, sql_query, params, *, replica, chunk_size):
+        if params is not None:
+            query_url = f"{self._base_url(replica)}/$sql"
+            body, iter_rows = [sql_query, *params], iter_sql_rows
+        else:
+            query_url = f"{self._base_url(replica)}/$psql"
+            body, iter_rows = {"query": sql_query}, iter_psql_rows
+        span = current_span()
+        async with self._client.post(
+            query_url,
+            json=body,
+            headers={"traceparent": span.traceparent} if span else None,
+        ) as resp:
+            if resp.status >= 400:
+                if params is None:
+                    resp.raise_for_status()
+                raise AidboxDBException(self._json_codec.loads(await resp.read()))
+            async for row in iter_rows(resp.content, chunk_size=chunk_size):
+                yield row
+
+    async def iterate(  # noqa: PLR0913
+        self,
+        table,
+        *,
+        where=None,
+        page_size=5000,
+        order_by=None,
+        as_resources=False,
+        prefetch=True,
+    ):
+        """
+        Iterates over rows of the resource table page by page using keyset pagination
+        by `id` or by `(txid, id)` (`order_by="txid"`), so the memory is bounded by a page.
+        `id` isn't unique in history tables (`db.PatientHistory`), so they are
+        paginated only by `(txid, id)` (default is "txid" for them and "id" otherwise).
+        Rows are converted with `row_to_resource` if `as_resources` is True.
+
+        The next page is requested while the current one is processed if `prefetch` is True
+
+            async for patient in db.iterate(db.Patient, where=..., as_resources=True):
+                ...
+        """
+        if page_size < 1:
+            raise ValueError("`page_size` must be greater than 0")
+        is_history = table.name.endswith("_history")
+        if order_by is None:
+            order_by = "txid" if is_history else "id"
+        if order_by not in ("id", "txid"):
+            raise ValueError("`order_by` must be one of id, txid")
+        if is_history and order_by != "txid":
+            raise ValueError('History table can be iterated only with `order_by="txid"`')
+        key_columns = [table.c.id] if order_by == "id" else [table.c.txid, table.c.id]
+
+        def page_statement(last_row):
+            statement = select(table).order_by(*key_columns).limit(page_size)
+            if where is not None:
+                statement = statement.where(where)
+            if last_row is not None:
+                if order_by == "id":
+                    statement = statement.where(table.c.id > last_row["id"])
+                else:
+                    statement = statement.where(
+                        tuple_(table.c.txid, table.c.id) > tuple_(last_row["txid"], last_row["id"])
+                    )
+            return statement
+
+        rows = await self.alchemy(page_statement(None))
+        while rows:
+            has_next_page = len(rows) == page_size
+            next_page = None
+            if has_next_page and prefetch:
+                next_page = asyncio.ensure_future(self.alchemy(page_statement(rows[-1])))
+            try:
+                for row in rows:
+                    yield row_to_resource(row) if as_resources else row
+            except BaseException:
+                # The iteration is stopped (GeneratorExit) or failed
+                if next_page is not None:
+                    next_page.cancel()
+                raise
+            if not has_next_page:
+                break
+            if next_page is None:
+                next_page = self.alchemy(page_statement(rows[-1]))
+            rows = await next_page
+
+    async def bulk_upsert(self, table, rows, *, chunk_size=1000, concurrency=4):
+        """
+        Inserts or updates rows of the resource table by multi-row
+        INSERT ... ON CONFLICT (id) DO UPDATE statements of `chunk_size` rows,
+        up to `concurrency` statements are executed at the same time.
+        Each row is a dict with `id`, `resource` and optional `resource_type`
+        (the resource type of the table by default).
+        Every row gets a new `txid`, the status is `created`, `updated`
+        or `recreated` (if the existing row is deleted).
+        Rows with the same `id` are deduplicated, the last one is written.
+
+        Returns the number of created, updated and recreated rows:
+        {"created": 10, "updated": 2, "recreated": 0}
+
+        NOTE: every chunk is a separate statement, so if a chunk fails,
+        the chunks that were already executed are not rolled back
+        """
+        if chunk_size < 1:
+            raise ValueError("`chunk_size` must be greater than 0")
+        if concurrency < 1:
+            raise ValueError("`concurrency` must be greater than 0")
+        default_resource_type = self._get_resource_type(table)
+
+        def build_statement(chunk):
+            statement = postgresql_insert(table).values(
+                [
+                    {
+                        "id": row["id"],
+                        "txid": func.nextval("transaction_id_seq"),
+                        "resource_type": row.get("resource_type", default_resource_type),
+                        "status": "created",
+                        "resource": row["resource"],
+                    }
+                    for row in chunk
+                ]
+            )
+            return statement.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={
+                    "txid": statement.excluded.txid,
+                    "ts": func.now(),
+                    "status": case((table.c.status == "deleted", "recreated"), else_="updated"),
+                    "resource": statement.excluded.resource,
+                },
+            ).returning(table.c.status)
+
+        # A statement can't update the same row twice and concurrent chunks
+        # with the same rows might deadlock, so only the last row of an id is kept
+        rows = list({row["id"]: row for row in rows}.values())
+        chunks = (rows[start : start + chunk_size] for start in range(0, len(rows), chunk_size))
+        counts = {"created": 0, "updated": 0, "recreated": 0}
+
+        async def worker():
+            # Workers take the next chunk when the previous one is written,
+            # so only `concurrency` statements are kept in memory
+            for chunk in chunks:
+                for row in await self.alchemy(build_statement(chunk)):
+                    counts[row["status"]] += 1
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            raise
+        return counts
+
+    def _get_resource_type(self, table):
+        for resource_type, cache in self._table_cache.items():
+            if cache["table_name"] == table.name:
+                return resource_type
+        return None
 
     async def _get_all_entities_name(self):
         result = None
@@ -150,7 +778,7 @@ class DBProxy:
         query_url = f"{self._settings.APP_INIT_URL}/$resource-types"
         async with self._client.get(query_url) as resp:
             if resp.status == 200:
-                json_resp = await resp.json()
+                json_resp = await resp.json(loads=self._json_codec.loads)
                 result = list(json_resp.keys())
 
         if not result:
@@ -159,7 +787,7 @@ class DBProxy:
                 f"{self._settings.APP_INIT_URL}/Entity?type=resource&_elements=id&_count=999"
             )
             async with self._client.get(query_url) as resp:
-                json_resp = await resp.json()
+                json_resp = await resp.json(loads=self._json_codec.loads)
                 result = [entry["resource"]["id"] for entry in json_resp.get("entry", [])]
 
         return result or []
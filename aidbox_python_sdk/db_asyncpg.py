@@ -0,0 +1,166 @@
+import datetime
+import decimal
+import logging
+
+from .exceptions import AidboxDBException
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+logger = logging.getLogger("aidbox_sdk.db")
+
+DB_BACKENDS = ("psql", "asyncpg")
+
+
+class AsyncpgBackend:
+    """
+    Executes DB Proxy queries directly in the Aidbox database via asyncpg pool
+
+    Every connection of the pool keeps up to `statement_cache_size` prepared
+    statements, so parameterized queries (`$1` placeholders) are prepared once
+    per connection.
+    Values of rows are converted to their JSON representation like in `$psql` results
+    """
+
+    def __init__(self, dsn, *, json_codec, min_size=1, max_size=10, statement_cache_size=100):
+        if asyncpg is None:
+            raise ImportError(
+                "asyncpg is required for asyncpg backend, "
+                "install it with `pip install aidbox-python-sdk[asyncpg]`"
+            )
+        if not dsn:
+            raise ValueError("DB_DSN setting is required for asyncpg backend")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self._json_codec = json_codec
+        self._pool = None
+
+    async def initialize(self):
+        self._pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size,
+            init=self._init_connection,
+        )
+
+    async def deinitialize(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _init_connection(self, connection):
+        # JSON values are decoded the same way as $psql results
+        for type_name in ("json", "jsonb"):
+            await connection.set_type_codec(
+                type_name,
+                encoder=self._encode_json,
+                decoder=self._json_codec.loads,
+                schema="pg_catalog",
+            )
+
+    def _encode_json(self, value):
+        # Values of SQLAlchemy statements are already serialized by bind processors
+        if isinstance(value, str):
+            return value
+        return self._json_codec.dumps(value)
+
+    async def fetch(self, sql_query, params=(), *, execute=False):
+        async with self._pool.acquire() as connection:
+            return await self._fetch(connection, sql_query, params, execute=execute)
+
+    async def stream(self, sql_query, params=(), *, prefetch=1000):
+        """
+        Yields rows fetched by a cursor by `prefetch` rows
+        """
+        async with self._pool.acquire() as connection:
+            try:
+                # Cursors are available only in a transaction
+                async with connection.transaction():
+                    cursor = connection.cursor(sql_query, *params, prefetch=prefetch)
+                    async for record in cursor:
+                        yield _record_to_row(record)
+            except asyncpg.PostgresError as exc:
+                raise _to_db_exception(exc) from exc
+
+    async def fetch_batch(self, statements, *, execute, transaction=False):
+        """
+        Executes statements one by one on the same connection and returns
+        results in the format of `$psql` (`{"status": ..., "result": ...}` per statement),
+        `execute` is the list of flags of the statements
+        """
+        results = []
+        async with self._pool.acquire() as connection:
+            tx = connection.transaction() if transaction else None
+            if tx is not None:
+                await tx.start()
+            failed = False
+            for sql_query, statement_execute in zip(statements, execute):
+                if failed and transaction:
+                    break
+                try:
+                    result = await self._fetch(connection, sql_query, (), execute=statement_execute)
+                except AidboxDBException as exc:
+                    failed = True
+                    results.append(exc.args[0])
+                else:
+                    results.append({"status": "success", "result": result})
+            if tx is not None:
+                await (tx.rollback() if failed else tx.commit())
+        return results
+
+    async def _fetch(self, connection, sql_query, params, *, execute):
+        try:
+            if execute:
+                await connection.execute(sql_query, *params)
+                return None
+            return [_record_to_row(record) for record in await connection.fetch(sql_query, *params)]
+        except asyncpg.PostgresError as exc:
+            raise _to_db_exception(exc) from exc
+
+
+def _to_db_exception(exc):
+    return AidboxDBException({"status": "error", "error": str(exc), "sqlstate": exc.sqlstate})
+
+
+def _record_to_row(record):
+    return {key: _to_json_value(value) for key, value in record.items()}
+
+
+def _datetime_to_json(value):
+    if value.utcoffset() == datetime.timedelta(0):
+        return value.replace(tzinfo=None).isoformat() + "Z"
+    return value.isoformat()
+
+
+def _decimal_to_json(value):
+    if value.is_finite() and value == value.to_integral_value():
+        return int(value)
+    return float(value)
+
+
+# datetime is a subclass of date, so it goes first
+_JSON_CONVERTERS = (
+    (datetime.datetime, _datetime_to_json),
+    (datetime.date, datetime.date.isoformat),
+    (datetime.time, datetime.time.isoformat),
+    (decimal.Decimal, _decimal_to_json),
+    (bytes, lambda value: "\\x" + value.hex()),
+)
+
+
+def _to_json_value(value):
+    # The same representation as in $psql results
+    if value is None or isinstance(value, (str, bool, int, float, dict)):
+        return value
+    if isinstance(value, list):
+        return [_to_json_value(item) for item in value]
+    for type_, convert in _JSON_CONVERTERS:
+        if isinstance(value, type_):
+            return convert(value)
+    # UUID, intervals, ranges, network addresses, etc.
+    return str(value)
@@ -0,0 +1,124 @@
+from .exceptions import AidboxDBException
+from .slow_queries import is_read_statement
+
+
+class BatchResult:
+    """
+    Result of a batch statement: `result` or `error` (AidboxDBException)
+    """
+
+    __slots__ = ("error", "result")
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def get(self):
+        """
+        Returns the result or raises the error of the statement
+        """
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"<BatchResult error={self.error!r}>"
+        return f"<BatchResult result={self.result!r}>"
+
+
+class DBBatch:
+    """
+    Collects SQL statements to execute them in a single `$psql` request
+    (or one by one on the same connection with asyncpg backend)
+
+    Statements are executed on the exit of `async with db.batch() as batch`
+    block (or by `await batch.execute()`) and `batch.results` contains
+    BatchResult per statement in the order they were added.
+    If `transaction` is True (asyncpg backend only), statements are executed
+    in a transaction that is rolled back if any of them fails (and results of
+    the other statements are "Transaction is rolled back" errors).
+    Statements with and without `execute` can't be mixed in a `$psql` batch.
+    The batch is executed on the replica only if all its statements are read only
+    (see `DBProxy.alchemy` and `DBProxy.raw_sql`)
+    """
+
+    def __init__(self, db, *, transaction=False):
+        self._db = db
+        self.transaction = transaction
+        self._statements = []
+        self._execute = []
+        self._read_only = []
+        self.results = None
+
+    def __len__(self):
+        return len(self._statements)
+
+    def raw_sql(self, sql_query, *, execute=False, read_only=False):
+        """
+        Adds SQL query to the batch and returns its index in `results`
+        """
+        if not isinstance(sql_query, str):
+            raise ValueError("sql_query must be a str")
+        if self.results is not None:
+            raise ValueError("Batch is already executed")
+        self._statements.append(sql_query.strip().rstrip(";"))
+        self._execute.append(execute)
+        self._read_only.append(read_only)
+        return len(self._statements) - 1
+
+    def alchemy(self, statement, *, execute=False, read_only=None):
+        """
+        Adds SQLAlchemy statement (compiled with literal values) to the batch
+        and returns its index in `results`
+        """
+        if read_only is None:
+            read_only = is_read_statement(statement)
+        return self.raw_sql(
+            self._db.compile_statement(statement), execute=execute, read_only=read_only
+        )
+
+    async def execute(self):
+        if self.results is not None:
+            raise ValueError("Batch is already executed")
+        if not self._statements:
+            self.results = []
+            return self.results
+        raw_results = await self._db._execute_batch(
+            self._statements,
+            execute=self._execute,
+            read_only=self._read_only,
+            transaction=self.transaction,
+        )
+        results = [
+            _to_batch_result(raw_results[index] if index < len(raw_results) else None)
+            for index in range(len(self._statements))
+        ]
+        if self.transaction and not all(result.ok for result in results):
+            rolled_back = AidboxDBException(
+                {"status": "error", "error": "Transaction is rolled back"}
+            )
+            results = [
+                result if not result.ok else BatchResult(error=rolled_back) for result in results
+            ]
+        self.results = results
+        return self.results
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.execute()
+
+
+def _to_batch_result(raw_result):
+    if raw_result is None:
+        return BatchResult(error=AidboxDBException({"status": "error", "error": "Not executed"}))
+    if raw_result.get("status") == "error":
+        return BatchResult(error=AidboxDBException(raw_result))
+    return BatchResult(result=raw_result.get("result"))
@@ -0,0 +1,113 @@
+import math
+import numbers
+from array import array
+
+from sqlalchemy.sql import sqltypes
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# array typecodes by SQLAlchemy type affinity, other types are kept in lists
+_TYPECODES = (
+    (sqltypes.Boolean, "b"),
+    (sqltypes.Integer, "q"),
+    (sqltypes.Numeric, "d"),
+    # Float isn't a subclass of Numeric since SQLAlchemy 2.1
+    (sqltypes.Float, "d"),
+)
+_NUMPY_DTYPES = {"b": "bool", "q": "int64", "d": "float64"}
+
+
+def get_typecodes(columns):
+    """
+    Returns names and array typecodes (None for untyped columns)
+    of (name, SQLAlchemy type) result columns of a statement
+    """
+    return [(name, _get_typecode(type_)) for name, type_ in columns]
+
+
+def _get_typecode(type_):
+    affinity = type_._type_affinity
+    for base_type, typecode in _TYPECODES:
+        if affinity is not None and issubclass(affinity, base_type):
+            return typecode
+    return None
+
+
+class ColumnBuilder:
+    """
+    Collects values of a column into `array` of the typecode.
+    Integer column becomes float column for NULL (NaN) or non-integer values,
+    the column falls back to list for values that don't fit the typecode
+    """
+
+    __slots__ = ("typecode", "values")
+
+    def __init__(self, typecode=None):
+        self.typecode = typecode
+        self.values = array(typecode) if typecode else []
+
+    def append(self, value):
+        if self.typecode is None:
+            self.values.append(value)
+            return
+        try:
+            if self.typecode == "d":
+                value = math.nan if value is None else float(value)
+            self.values.append(value)
+        except (TypeError, ValueError, OverflowError):
+            if self.typecode == "q" and (value is None or isinstance(value, numbers.Number)):
+                self.typecode = "d"
+                self.values = array("d", self.values)
+            else:
+                self.typecode = None
+                self.values = self.values.tolist()
+            self.append(value)
+
+    def build(self, use_numpy=False):
+        if not use_numpy:
+            return self.values
+        if np is None:
+            raise ImportError(
+                "numpy is required for numpy columns, "
+                "install it with `pip install aidbox-python-sdk[numpy]`"
+            )
+        if self.typecode is None:
+            # Values might be lists (JSON arrays), numpy must not treat them as dimensions
+            result = np.empty(len(self.values), dtype=object)
+            result[:] = self.values
+            return result
+        # The array shares its buffer, so the values are not copied
+        return np.frombuffer(self.values, dtype=_NUMPY_DTYPES[self.typecode])
+
+
+def has_numpy():
+    return np is not None
+
+
+async def collect_columns(rows, columns, *, use_numpy=None):
+    """
+    Collects rows (an async iterable of dicts) into a dict of columns:
+    numpy arrays if `use_numpy` (numpy is used if it's installed by default)
+    or `array`/list otherwise.
+    `columns` are (name, typecode) pairs of the statement, the typecodes are matched
+    with the rows' keys by position
+    """
+    if use_numpy is None:
+        use_numpy = has_numpy()
+    builders = None
+    async for row in rows:
+        if builders is None:
+            typecodes = [typecode for _, typecode in columns]
+            if len(typecodes) != len(row):
+                typecodes = [None] * len(row)
+            builders = {
+                name: ColumnBuilder(typecode) for name, typecode in zip(row.keys(), typecodes)
+            }
+        for name, value in row.items():
+            builders[name].append(value)
+    if builders is None:
+        builders = {name: ColumnBuilder(typecode) for name, typecode in columns}
+    return {name: builder.build(use_numpy) for name, builder in builders.items()}
@@ -0,0 +1,134 @@
+import codecs
+import json
+
+from .exceptions import AidboxDBException
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _JSONStream:
+    """
+    Buffer of the response body that is decoded incrementally:
+    values are decoded as soon as they are completely received
+    and the decoded part of the body is dropped
+    """
+
+    def __init__(self, content, chunk_size):
+        self._chunks = content.iter_chunked(chunk_size)
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    async def _read(self, min_size=1):
+        """
+        Drops the decoded part of the buffer and appends at least `min_size`
+        characters (or the rest of the response) to it
+        """
+        if self._eof:
+            raise AidboxDBException({"status": "error", "error": "Unexpected end of response"})
+        parts = [self._buffer[self._pos :]]
+        size = 0
+        while size < min_size:
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+                parts.append(self._text_decoder.decode(b"", True))
+                break
+            text = self._text_decoder.decode(chunk)
+            parts.append(text)
+            size += len(text)
+        self._buffer = "".join(parts)
+        self._pos = 0
+
+    async def peek(self):
+        """
+        Skips whitespaces and returns the next character
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            await self._read()
+
+    async def expect(self, *chars):
+        char = await self.peek()
+        if char not in chars:
+            raise AidboxDBException(
+                {"status": "error", "error": f"Unexpected character in response: {char!r}"}
+            )
+        self._pos += 1
+        return char
+
+    async def value(self):
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as exc:
+                if self._eof:
+                    raise AidboxDBException(
+                        {"status": "error", "error": f"Invalid JSON in response: {exc}"}
+                    ) from exc
+            else:
+                # A number might be cut at the end of the buffer
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            # The value isn't received completely: the buffer is at least doubled
+            # before the value is decoded again, so a large value is decoded
+            # O(log(size / chunk_size)) times instead of once per chunk
+            await self._read(len(self._buffer) - self._pos)
+
+    async def array(self):
+        """
+        Yields values of the array
+        """
+        await self.expect("[")
+        if await self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield await self.value()
+            if await self.expect(",", "]") == "]":
+                return
+
+
+async def iter_psql_rows(content, *, chunk_size=65536):
+    """
+    Yields rows of the first statement of `$psql` response
+    (`[{"status": ..., "result": [row, ...]}]`) as they are received,
+    raises AidboxDBException if the statement failed
+    """
+    stream = _JSONStream(content, chunk_size)
+    await stream.expect("[")
+    await stream.expect("{")
+    statement = {}
+    if await stream.peek() != "}":
+        while True:
+            key = await stream.value()
+            await stream.expect(":")
+            if key == "result" and await stream.peek() == "[":
+                if statement.get("status") == "error":
+                    raise AidboxDBException(statement)
+                async for row in stream.array():
+                    yield row
+                statement[key] = None
+            else:
+                statement[key] = await stream.value()
+            if await stream.expect(",", "}") == "}":
+                break
+    if statement.get("status") == "error":
+        raise AidboxDBException(statement)
+
+
+async def iter_sql_rows(content, *, chunk_size=65536):
+    """
+    Yields rows of `$sql` response (`[row, ...]`) as they are received
+    """
+    stream = _JSONStream(content, chunk_size)
+    async for row in stream.array():
+        yield row
@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+OPERATION_EXECUTORS = ("inline", "thread", "process")
+
+
+class OperationThreadPool:
+    """
+    Thread pool to run synchronous operation handlers off the event loop
+
+    The pool is created on the first call and might be shut down
+    and created again (it's done on the app cleanup)
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._started = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self._submitted - self._started,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+
+    async def run(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="aidbox-sdk-operation",
+            )
+        with self._lock:
+            self._submitted += 1
+        # The context is copied to keep the current tracing span in the thread
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, context.run, self._call, func, args
+        )
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _call(self, func, args):
+        with self._lock:
+            self._started += 1
+            self._running += 1
+        try:
+            result = func(*args)
+        except BaseException:
+            with self._lock:
+                self._failed += 1
+            raise
+        else:
+            with self._lock:
+                self._completed += 1
+            return result
+        finally:
+            with self._lock:
+                self._running -= 1
+
+
+class OperationProcessPool:
+    """
+    Process pool to run CPU-bound operation handlers
+
+    The handler must be a module level function (it's pickled by reference)
+    and it gets the JSON-safe part of the request (without `app` key).
+    Workers are spawned, not forked: forking while the app's threads
+    (thread pool, loop monitor watchdog, etc.) hold locks might deadlock the child.
+    The pool is started and shut down by the app lifecycle
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+
+    @property
+    def is_running(self):
+        return self._executor is not None
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self._submitted - self._completed - self._failed,
+            "completed": self._completed,
+            "failed": self._failed,
+        }
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    async def run(self, func, operation, request):
+        if self._executor is None:
+            raise RuntimeError("Operation process pool is not started")
+        request = {key: value for key, value in request.items() if key != "app"}
+        self._submitted += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _run_in_process, func, operation, request
+            )
+        except BaseException:
+            self._failed += 1
+            raise
+        self._completed += 1
+        return result
+
+
+def _run_in_process(func, operation, request):
+    result = func(operation, request)
+    if asyncio.iscoroutine(result):
+        return asyncio.run(result)
+    return result
@@ -1,11 +1,16 @@
 import asyncio
+import hmac
 import logging
+import time
 from typing import Any
 
 from aiohttp import web
 from fhirpy.base.exceptions import OperationOutcome
 
 from . import app_keys as ak
+from . import metrics
+from .streaming import is_async_iterable, stream_response
+from .tracing import tracer
 
 logger = logging.getLogger("aidbox_sdk")
 routes = web.RouteTableDef()
@@ -16,14 +21,25 @@ async def subscription(request: web.Request, data: dict):
     if "handler" not in data or "event" not in data:
         logger.error("`handler` and/or `event` param is missing, data: %s", data)
         raise web.HTTPBadRequest()
-    handler = request.app[ak.sdk].get_subscription_handler(data["handler"])
+    sdk = request.app[ak.sdk]
+    handler = sdk.get_subscription_handler(data["handler"])
     if not handler:
         logger.error("Subscription handler `%s` was not found", "handler")
         raise web.HTTPNotFound()
+    key = sdk.get_subscription_ordering_key(data["handler"], data["event"])
+    coalescing_key = sdk.get_subscription_coalescing_key(data["handler"], data["event"])
     result = handler(data["event"], request)
     if asyncio.iscoroutine(result):
-        asyncio.get_event_loop().create_task(result)
-    return web.json_response({})
+        submitted = await sdk.subscription_executor.submit(
+            result,
+            key=key,
+            coalescing_key=coalescing_key,
+            version=int(data["event"]["tx"]["id"]) if coalescing_key else None,
+        )
+        if not submitted:
+            logger.warning("Subscription queue is full, `%s` event is rejected", data["handler"])
+            raise web.HTTPServiceUnavailable(headers={"Retry-After": "1"})
+    return web.json_response({}, dumps=sdk.json_codec.dumps)
 
 
 async def operation(request: web.Request, data: dict[str, Any]):
@@ -31,23 +47,46 @@ async def operation(request: web.Request, data: dict[str, Any]):
     if "operation" not in data or "id" not in data["operation"]:
         logger.error("`operation` or `operation[id]` param is missing, data: %s", data)
         raise web.HTTPBadRequest()
-    handler = request.app[ak.sdk].get_operation_handler(data["operation"]["id"])
+    sdk = request.app[ak.sdk]
+    handler = sdk.get_operation_handler(data["operation"]["id"])
     if not handler:
         logger.error("Operation handler `%s` was not found", data["handler"])
         raise web.HTTPNotFound()
+    operation_id = data["operation"]["id"]
+    started_at = time.perf_counter()
+    span = tracer.start_span("operation.handler", attributes={"operation.id": operation_id})
     try:
-        data["request"]["app"] = request.app
-        result = handler(data["operation"], data["request"])
-        if asyncio.iscoroutine(result):
-            try:
-                return await result
-            except asyncio.CancelledError as err:
-                logger.error("Aidbox timeout for %s", data["operation"])
-                raise err
-
-        return result
+        with span, sdk.profiler.profile(operation_id), sdk.loop_monitor.track(operation_id):
+            return await _call_operation_handler(request, handler, data)
     except OperationOutcome as exc:
-        return web.json_response(exc.resource, status=422)
+        metrics.operation_errors.inc(operation_id)
+        return web.json_response(exc.resource, status=422, dumps=sdk.json_codec.dumps)
+    except Exception:
+        metrics.operation_errors.inc(operation_id)
+        raise
+    finally:
+        metrics.operation_duration.observe(time.perf_counter() - started_at, operation_id)
+
+
+async def _call_operation_handler(request: web.Request, handler, data: dict[str, Any]):
+    sdk = request.app[ak.sdk]
+    data["request"]["app"] = request.app
+    result = handler(data["operation"], data["request"])
+    if asyncio.iscoroutine(result):
+        try:
+            result = await result
+        except asyncio.CancelledError as err:
+            logger.error("Aidbox timeout for %s", data["operation"])
+            raise err
+
+    if is_async_iterable(result):
+        return await stream_response(
+            request,
+            result,
+            stream_format=sdk.get_operation_stream_format(data["operation"]["id"]),
+            dumps=sdk.json_codec.dumps,
+        )
+    return result
 
 
 TYPES = {
@@ -59,10 +98,18 @@ TYPES = {
 @routes.post("/aidbox")
 async def dispatch(request):
     logger.debug("Dispatch new request %s %s", request.method, request.url)
-    data = await request.json()
-    if "type" in data and data["type"] in TYPES:
-        logger.debug("Dispatch to `%s` handler", data["type"])
-        return await TYPES[data["type"]](request, data)
+    sdk = request.app[ak.sdk]
+    json_codec = sdk.json_codec
+    with tracer.start_span(
+        "aidbox.dispatch", traceparent=request.headers.get("traceparent")
+    ) as span:
+        body = await request.read()
+        span.set_attribute("aidbox.request_size", len(body))
+        data = json_codec.loads(body)
+        if "type" in data and data["type"] in TYPES:
+            logger.debug("Dispatch to `%s` handler", data["type"])
+            span.set_attribute("aidbox.type", data["type"])
+            return await TYPES[data["type"]](request, data)
     req = {
         "method": request.method,
         "url": str(request.url),
@@ -71,7 +118,7 @@ async def dispatch(request):
         "text": await request.text(),
         "charset": request.charset,
     }
-    return web.json_response(req, status=200)
+    return web.json_response(req, status=200, dumps=json_codec.dumps)
 
 
 @routes.get("/health")
@@ -82,3 +129,63 @@ async def health_check(request):
 @routes.get("/live")
 async def live_health_check(request):
     return web.json_response({"status": "OK"}, status=200)
+
+
+def _check_profiling_access(request):
+    token = request.app[ak.settings].PROFILING_ADMIN_TOKEN
+    if not token:
+        raise web.HTTPNotFound()
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        raise web.HTTPUnauthorized()
+
+
+@routes.get("/profiling")
+async def profiling_summary(request):
+    _check_profiling_access(request)
+    return web.json_response(request.app[ak.sdk].profiler.summary())
+
+
+@routes.post("/profiling")
+async def profiling_configure(request):
+    _check_profiling_access(request)
+    profiler = request.app[ak.sdk].profiler
+    try:
+        data = await request.json()
+        if not isinstance(data, dict):
+            raise ValueError("Body must be a JSON object")
+        profiler.configure(sample_rate=data.get("sample_rate"), mode=data.get("mode"))
+    except ValueError as exc:
+        raise web.HTTPBadRequest(text=str(exc)) from exc
+    return web.json_response(profiler.summary())
+
+
+@routes.delete("/profiling")
+async def profiling_reset(request):
+    _check_profiling_access(request)
+    profiler = request.app[ak.sdk].profiler
+    profiler.reset()
+    return web.json_response(profiler.summary())
+
+
+@routes.get("/profiling/pstats")
+async def profiling_pstats(request):
+    _check_profiling_access(request)
+    return web.Response(
+        body=request.app[ak.sdk].profiler.dump_pstats(request.query.get("key")),
+        content_type="application/octet-stream",
+    )
+
+
+@routes.get("/profiling/collapsed")
+async def profiling_collapsed(request):
+    _check_profiling_access(request)
+    return web.Response(text=request.app[ak.sdk].profiler.dump_collapsed(request.query.get("key")))
+
+
+@routes.get("/metrics")
+async def metrics_handler(request):
+    text = metrics.registry.render(metrics.sdk_gauges(request.app[ak.sdk]))
+    return web.Response(
+        body=text.encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
@@ -0,0 +1,62 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("aidbox_sdk")
+
+JSON_CODECS = ("json", "orjson", "auto")
+
+
+class JSONCodec:
+    """
+    Standard library JSON codec
+
+    `loads` accepts both str and bytes, `dumps` returns str
+    """
+
+    name = "json"
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+
+class ORJSONCodec(JSONCodec):
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError(
+                "orjson is required for orjson codec, "
+                "install it with `pip install aidbox-python-sdk[orjson]`"
+            )
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj).decode()
+
+
+def get_json_codec(name="json"):
+    """
+    Returns JSON codec by name: "json" (standard library), "orjson"
+    or "auto" that uses orjson if it's installed.
+    Falls back to the standard library if orjson is not installed
+    """
+    if name not in JSON_CODECS:
+        raise ValueError(f"JSON codec must be one of {', '.join(JSON_CODECS)}")
+    if name == "json":
+        return JSONCodec()
+    try:
+        return ORJSONCodec()
+    except ImportError:
+        if name == "orjson":
+            logger.warning("orjson is not installed, the standard library json is used instead")
+        return JSONCodec()
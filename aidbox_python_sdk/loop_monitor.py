@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager, suppress
+
+from . import metrics
+
+logger = logging.getLogger("aidbox_sdk")
+
+
+class LoopMonitor:
+    """
+    Measures the lag of the event loop and detects handlers that block it
+
+    A background task wakes up every `interval` seconds and records how late it
+    was woken up. A watchdog thread checks that the task is not late for more
+    than `slow_threshold` seconds, otherwise it logs the operation id/subscription
+    handler (see `track`) that holds the loop together with its stack
+    """
+
+    def __init__(self, *, interval=0.1, slow_threshold=0.25, window_size=1000):
+        if interval <= 0 or slow_threshold <= 0:
+            raise ValueError("`interval` and `slow_threshold` must be positive")
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self._lags = deque(maxlen=window_size)
+        self._labels = {}
+        self._slow_handlers = 0
+        self._loop = None
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._last_tick = 0.0
+
+    @property
+    def is_running(self):
+        return self._task is not None
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="aidbox-sdk-loop-monitor", daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._watchdog.join()
+        self._task = None
+        self._watchdog = None
+
+    @contextmanager
+    def track(self, label):
+        """
+        Marks the current task as a handler with `label` for slow handler reports
+        """
+        task = asyncio.current_task()
+        if task is None:
+            yield
+            return
+        self._labels[task] = label
+        try:
+            yield
+        finally:
+            self._labels.pop(task, None)
+
+    def stats(self):
+        lags = sorted(self._lags)
+        return {
+            "lag_p50": _percentile(lags, 0.5),
+            "lag_p90": _percentile(lags, 0.9),
+            "lag_p99": _percentile(lags, 0.99),
+            "lag_max": lags[-1] if lags else 0.0,
+            "slow_handlers": self._slow_handlers,
+        }
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started_at = loop.time()
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started_at - self.interval, 0.0)
+            self._lags.append(lag)
+            metrics.event_loop_lag.observe(lag)
+
+    def _watch(self):
+        reported_tick = None
+        while not self._stopped.wait(self.interval):
+            last_tick = self._last_tick
+            blocked_for = time.monotonic() - last_tick - self.interval
+            if blocked_for < self.slow_threshold or reported_tick == last_tick:
+                continue
+            reported_tick = last_tick
+            self._report(blocked_for)
+
+    def _report(self, blocked_for):
+        # Both the current task and the frame are read from another thread,
+        # so the report is the best effort
+        task = asyncio.current_task(self._loop)
+        label = self._labels.get(task, "<unknown>") if task else "<unknown>"
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        self._slow_handlers += 1
+        metrics.slow_handlers.inc(label)
+        logger.warning(
+            "Event loop is blocked for more than %.3fs by `%s`:\n%s", blocked_for, label, stack
+        )
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
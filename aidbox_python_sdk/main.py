@@ -63,7 +63,15 @@ async def init(app: web.Application):
     app["db"] = app[ak.db]  # For backwards compatibility
     await register_app(app[ak.sdk], app[ak.client])
     await app[ak.db].initialize()
+    await app[ak.sdk].subscription_executor.start()
+    app[ak.sdk].operation_process_pool.start()
+    if app[ak.settings].LOOP_MONITOR_ENABLED:
+        await app[ak.sdk].loop_monitor.start()
     yield
+    await app[ak.sdk].loop_monitor.stop()
+    await app[ak.sdk].subscription_executor.stop()
+    app[ak.sdk].operation_thread_pool.shutdown()
+    app[ak.sdk].operation_process_pool.shutdown()
     await app[ak.db].deinitialize()
 
 
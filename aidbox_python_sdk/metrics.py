@@ -0,0 +1,191 @@
+import math
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        values = self._values.get(labels)
+        if values is None:
+            values = self._values[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            values[index] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def get_count(self, *labels):
+        values = self._values.get(labels)
+        return values[-1] if values else 0
+
+    def samples(self):
+        for labels, values in self._values.items():
+            base_labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield f"{self.name}_bucket", {**base_labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_bucket", {**base_labels, "le": "+Inf"}, values[-1]
+            yield f"{self.name}_sum", base_labels, values[-2]
+            yield f"{self.name}_count", base_labels, values[-1]
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name, documentation, value=0):
+        self.name = name
+        self.documentation = documentation
+        self.value = value
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield self.name, {}, self.value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric `{metric.name}` is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self, extra_metrics=()):
+        """
+        Renders metrics in Prometheus text format
+        """
+        lines = []
+        for metric in [*self._metrics.values(), *extra_metrics]:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    formatted = ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+    return f"{{{formatted}}}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+registry = MetricsRegistry()
+
+operation_duration = registry.histogram(
+    "aidbox_sdk_operation_duration_seconds",
+    "Duration of operation handlers",
+    ("operation_id",),
+)
+operation_errors = registry.counter(
+    "aidbox_sdk_operation_errors_total",
+    "Number of operation handlers that failed (including OperationOutcome)",
+    ("operation_id",),
+)
+subscription_duration = registry.histogram(
+    "aidbox_sdk_subscription_duration_seconds",
+    "Duration of subscription handlers",
+    ("handler",),
+)
+subscription_errors = registry.counter(
+    "aidbox_sdk_subscription_errors_total",
+    "Number of subscription handlers that failed",
+    ("handler",),
+)
+db_query_duration = registry.histogram(
+    "aidbox_sdk_db_query_duration_seconds",
+    "Duration of DB Proxy queries",
+)
+db_query_errors = registry.counter(
+    "aidbox_sdk_db_query_errors_total",
+    "Number of DB Proxy queries that failed",
+)
+aidbox_request_duration = registry.histogram(
+    "aidbox_sdk_aidbox_request_duration_seconds",
+    "Duration of Aidbox client requests",
+    ("method",),
+)
+event_loop_lag = registry.histogram(
+    "aidbox_sdk_event_loop_lag_seconds",
+    "Lag of the event loop (requires LOOP_MONITOR_ENABLED)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+slow_handlers = registry.counter(
+    "aidbox_sdk_slow_handlers_total",
+    "Number of times a handler blocked the event loop longer than LOOP_MONITOR_SLOW_THRESHOLD",
+    ("handler",),
+)
+
+
+def sdk_gauges(sdk):
+    """
+    Returns the current state of SDK executors (in-flight and queued tasks, etc.) as gauges
+    """
+    gauges = []
+    for prefix, title, executor in [
+        ("aidbox_sdk_subscription_executor", "subscription executor", sdk.subscription_executor),
+        ("aidbox_sdk_operation_thread_pool", "operation thread pool", sdk.operation_thread_pool),
+        ("aidbox_sdk_operation_process_pool", "operation process pool", sdk.operation_process_pool),
+    ]:
+        for key, value in executor.stats().items():
+            gauges.append(Gauge(f"{prefix}_{key}", f"`{key}` of {title}", value or 0))
+    if sdk.loop_monitor.is_running:
+        for key, value in sdk.loop_monitor.stats().items():
+            if key.startswith("lag_"):
+                name = f"aidbox_sdk_event_loop_{key}_seconds"
+                gauges.append(Gauge(name, f"`{key}` of the event loop", value))
+    return gauges
@@ -0,0 +1,150 @@
+import cProfile
+import marshal
+import pstats
+import random
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILING_MODES = ("cprofile", "sampling")
+
+
+class DispatchProfiler:
+    """
+    Profiles a fraction (`sample_rate`) of operation and subscription handler
+    invocations and aggregates the results per operation id/subscription handler
+
+    "cprofile" mode collects deterministic stats with cProfile (available as pstats),
+    "sampling" mode samples the stack of the event loop thread every
+    `sampling_interval` seconds (available as collapsed stacks for flame graphs).
+
+    NOTE: the handlers share the event loop, so the results include the code
+    of the other tasks that were executed while the profiled handler was awaiting.
+    Only one invocation is profiled at a time
+    """
+
+    def __init__(self, *, sample_rate=0.0, mode="cprofile", sampling_interval=0.005):
+        self._stats = {}
+        self._stacks = {}
+        self._invocations = Counter()
+        self._active = False
+        self.configure(sample_rate=sample_rate, mode=mode, sampling_interval=sampling_interval)
+
+    def configure(self, *, sample_rate=None, mode=None, sampling_interval=None):
+        if sample_rate is not None:
+            if not _is_number(sample_rate) or not 0 <= sample_rate <= 1:
+                raise ValueError("`sample_rate` must be a number between 0 and 1")
+            self.sample_rate = sample_rate
+        if mode is not None:
+            if not isinstance(mode, str) or mode not in PROFILING_MODES:
+                raise ValueError(f"`mode` must be one of {', '.join(PROFILING_MODES)}")
+            self.mode = mode
+        if sampling_interval is not None:
+            if not _is_number(sampling_interval) or sampling_interval <= 0:
+                raise ValueError("`sampling_interval` must be a positive number")
+            self.sampling_interval = sampling_interval
+
+    def summary(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "mode": self.mode,
+            "invocations": dict(self._invocations),
+        }
+
+    def reset(self):
+        self._stats = {}
+        self._stacks = {}
+        self._invocations = Counter()
+
+    @contextmanager
+    def profile(self, key):
+        """
+        Profiles the code inside the block if the invocation is sampled
+        """
+        if self._active or not self.sample_rate or random.random() >= self.sample_rate:
+            yield
+            return
+
+        self._active = True
+        self._invocations[key] += 1
+        try:
+            if self.mode == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    if key in self._stats:
+                        self._stats[key].add(profiler)
+                    else:
+                        self._stats[key] = pstats.Stats(profiler)
+            else:
+                sampler = _StackSampler(threading.get_ident(), self.sampling_interval)
+                sampler.start()
+                try:
+                    yield
+                finally:
+                    sampler.stop()
+                    self._stacks.setdefault(key, Counter()).update(sampler.stacks)
+        finally:
+            self._active = False
+
+    def dump_pstats(self, key=None):
+        """
+        Returns stats collected in "cprofile" mode (for `key` or for all keys)
+        in the format of `pstats.Stats.dump_stats`
+        """
+        stats = pstats.Stats()
+        for stats_key, key_stats in self._stats.items():
+            if key is None or stats_key == key:
+                stats.add(key_stats)
+        return marshal.dumps(stats.stats)
+
+    def dump_collapsed(self, key=None):
+        """
+        Returns stacks collected in "sampling" mode (for `key` or for all keys)
+        in the collapsed format (`frame;frame;frame count` per line)
+        """
+        stacks = Counter()
+        for stacks_key, key_stacks in self._stacks.items():
+            if key is None or stacks_key == key:
+                stacks.update(key_stacks)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def _is_number(value):
+    # Values come from JSON of the admin route, bool is a subclass of int
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _StackSampler:
+    def __init__(self, thread_id, interval):
+        self.stacks = Counter()
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="aidbox-sdk-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[_collapse_stack(frame)] += 1
+
+
+def _collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})".replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
@@ -1,13 +1,23 @@
 import asyncio
 import logging
+import time
 from typing import Optional
 
-import jsonschema
+from aiohttp import web
 from fhirpy.base.exceptions import OperationOutcome
 
+from . import metrics
 from .aidboxpy import AsyncAidboxClient
 from .db_migrations import sdk_migrations
+from .executors import OPERATION_EXECUTORS, OperationProcessPool, OperationThreadPool
+from .json_codec import get_json_codec
+from .loop_monitor import LoopMonitor
+from .profiling import DispatchProfiler
+from .streaming import STREAM_FORMATS
+from .subscriptions import SubscriptionBatcher, SubscriptionExecutor
+from .tracing import create_span_exporter, current_span, tracer
 from .types import Compliance
+from .validators import create_request_validator
 
 logger = logging.getLogger("aidbox_sdk")
 
@@ -16,7 +26,7 @@ _SubTriggered = dict[str, tuple[asyncio.AbstractEventLoop, asyncio.Future[bool],
 
 
 class SDK:
-    def __init__(
+    def __init__(  # noqa: PLR0913
         self,
         settings,
         *,
@@ -24,12 +34,44 @@ class SDK:
         resources=None,
         seeds=None,
         migrations=None,
+        subscription_executor: Optional[SubscriptionExecutor] = None,
     ):
         self.settings = settings
+        self.json_codec = get_json_codec(settings.JSON_CODEC)
+        if settings.TRACING_EXPORTER:
+            tracer.configure(
+                create_span_exporter(
+                    settings.TRACING_EXPORTER,
+                    path=settings.TRACING_FILE_PATH,
+                    max_spans=settings.TRACING_MEMORY_MAX_SPANS,
+                )
+            )
+        self.tracer = tracer
+        self.profiler = DispatchProfiler(
+            sample_rate=settings.PROFILING_SAMPLE_RATE, mode=settings.PROFILING_MODE
+        )
+        self.loop_monitor = LoopMonitor(
+            interval=settings.LOOP_MONITOR_INTERVAL,
+            slow_threshold=settings.LOOP_MONITOR_SLOW_THRESHOLD,
+        )
+        self.subscription_executor = subscription_executor or SubscriptionExecutor(
+            max_concurrency=settings.SUBSCRIPTION_MAX_CONCURRENCY,
+            max_queue_size=settings.SUBSCRIPTION_QUEUE_SIZE,
+            queue_timeout=settings.SUBSCRIPTION_QUEUE_TIMEOUT,
+        )
+        self.operation_thread_pool = OperationThreadPool(
+            max_workers=settings.OPERATION_THREAD_POOL_SIZE
+        )
+        self.operation_process_pool = OperationProcessPool(
+            max_workers=settings.OPERATION_PROCESS_POOL_SIZE or None
+        )
         self._subscriptions = {}
         self._subscription_handlers = {}
+        self._subscription_ordering_keys = {}
+        self._subscription_coalescing = set()
         self._operations = {}
         self._operation_handlers = {}
+        self._operation_stream_formats = {}
         self._manifest = {
             "apiVersion": 1,
             "type": "app",
@@ -93,47 +135,148 @@ class SDK:
             self._manifest["operations"] = self._operations
         return self._manifest
 
-    def subscription(self, entity):
+    def subscription(  # noqa: PLR0913
+        self,
+        entity,
+        *,
+        ordered=False,
+        ordering_key=None,
+        batch_size=None,
+        max_wait_ms=100,
+        coalesce=False,
+    ):
+        """
+        Registers subscription handler for `entity`
+
+        Set `ordered` to True to process events of the same resource strictly
+        one after another in the order they are received, events of different
+        resources are still processed in parallel. By default events are ordered
+        by `event["resource"]["id"]`, pass `ordering_key` function
+        that accepts the event to order them by another key
+
+        Set `batch_size` to receive a list of events instead of a single event,
+        the list is passed to the handler when it has `batch_size` events
+        or when `max_wait_ms` milliseconds passed since its first event
+
+        Set `coalesce` to True to process only the latest event of a resource:
+        a waiting event is replaced by a newer event (by `event["tx"]["id"]`)
+        of the same resource, the number of replaced events is available
+        as `coalesced` in `sdk.subscription_executor.stats()`.
+        Coalesced subscription is ordered, so events of a resource wait
+        while its previous event is processed (`ordering_key` must keep
+        events of the same resource under the same key)
+        """
+        if ordering_key is not None or coalesce:
+            ordered = True
+        if ordered and ordering_key is None:
+            ordering_key = _resource_id_key
+        if batch_size is not None:
+            if batch_size < 1:
+                raise ValueError("`batch_size` must be greater than 0")
+            if coalesce:
+                raise ValueError("Subscription might be coalesced or batched, not both")
+            if ordered:
+                raise ValueError("Subscription might be ordered or batched, not both")
+
         def wrap(func):
             path = func.__name__
             self._subscriptions[entity] = {"handler": path}
 
-            async def handler(event, request):
-                if self._test_start_txid is not None:
-                    # Skip outside test
-                    if self._test_start_txid == -1:
+            async def call_handler(event_or_events, request, events_count, parent_span):
+                started_at = time.perf_counter()
+                span = tracer.start_span(
+                    "subscription.handler",
+                    attributes={"subscription.handler": path, "events": events_count},
+                    parent=parent_span,
+                )
+                try:
+                    with span, self.profiler.profile(path), self.loop_monitor.track(path):
+                        coro_or_result = func(event_or_events, request)
+                        if asyncio.iscoroutine(coro_or_result):
+                            result = await coro_or_result
+                        else:
+                            logger.warning(
+                                "Synchronous subscription handler is deprecated: %s", path
+                            )
+                            result = coro_or_result
+                except Exception:
+                    metrics.subscription_errors.inc(path)
+                    raise
+                finally:
+                    metrics.subscription_duration.observe(time.perf_counter() - started_at, path)
+
+                self._notify_subscription_triggered(entity, events_count)
+                return result
+
+            if batch_size is None:
+
+                async def handle_event(event, request, parent_span):
+                    if self._is_skipped_event(event):
                         return None
+                    return await call_handler(event, request, 1, parent_span)
+
+            else:
+                batcher = SubscriptionBatcher(batch_size=batch_size, max_wait_ms=max_wait_ms)
 
-                    # Skip inside another test
-                    if int(event["tx"]["id"]) < self._test_start_txid:
+                async def handle_event(event, request, parent_span):
+                    if self._is_skipped_event(event):
+                        return None
+                    events = await batcher.add(event)
+                    # The batch is flushed by the handler of its first event
+                    if events is None:
                         return None
-                coro_or_result = func(event, request)
-                if asyncio.iscoroutine(coro_or_result):
-                    result = await coro_or_result
-                else:
-                    logger.warning("Synchronous subscription handler is deprecated: %s", path)
-                    result = coro_or_result
-
-                if entity in self._sub_triggered:
-                    target_loop, future, counter = self._sub_triggered[entity]
-                    if counter > 1:
-                        self._sub_triggered[entity] = (target_loop, future, counter - 1)
-                    elif future.done():
-                        pass
-                        # logger.warning('Uncaught subscription for %s', entity)
-                    else:
-                        target_loop.call_soon_threadsafe(future.set_result, True)
+                    return await call_handler(events, request, len(events), parent_span)
 
-                return result
+            def handler(event, request):
+                # The coroutine is executed by the subscription executor in another task,
+                # so the dispatch span is passed explicitly
+                return handle_event(event, request, current_span())
 
             self._subscription_handlers[path] = handler
+            if ordered:
+                self._subscription_ordering_keys[path] = ordering_key
+            if coalesce:
+                self._subscription_coalescing.add(path)
             return func
 
         return wrap
 
+    def _is_skipped_event(self, event):
+        if self._test_start_txid is not None:
+            # Skip outside test
+            if self._test_start_txid == -1:
+                return True
+
+            # Skip inside another test
+            if int(event["tx"]["id"]) < self._test_start_txid:
+                return True
+        return False
+
+    def _notify_subscription_triggered(self, entity, events_count):
+        if entity in self._sub_triggered:
+            target_loop, future, counter = self._sub_triggered[entity]
+            if counter > events_count:
+                self._sub_triggered[entity] = (target_loop, future, counter - events_count)
+            elif future.done():
+                pass
+                # logger.warning('Uncaught subscription for %s', entity)
+            else:
+                target_loop.call_soon_threadsafe(future.set_result, True)
+
     def get_subscription_handler(self, path):
         return self._subscription_handlers.get(path)
 
+    def get_subscription_ordering_key(self, path, event):
+        ordering_key = self._subscription_ordering_keys.get(path)
+        if ordering_key is None:
+            return None
+        return (path, ordering_key(event))
+
+    def get_subscription_coalescing_key(self, path, event):
+        if path not in self._subscription_coalescing:
+            return None
+        return (path, _resource_id_key(event))
+
     def was_subscription_triggered_n_times(self, entity, counter):
         timeout = 10
         target_loop = asyncio.get_running_loop()
@@ -157,13 +300,54 @@ class SDK:
         request_schema=None,
         timeout=None,
         compliance: Optional[Compliance] = None,
+        *,
+        executor: Optional[str] = None,
+        request_validator_backend: Optional[str] = None,
+        request_validation_max_errors: Optional[int] = None,
+        stream_format: str = "json",
     ):
+        """
+        Registers operation handler
+
+        `executor` defines where the handler is executed: "inline" runs it
+        on the event loop, "thread" runs request validation and synchronous
+        handler in `sdk.operation_thread_pool` and "process" runs the handler
+        in `sdk.operation_process_pool`. Default is `settings.OPERATION_EXECUTOR`
+
+        The handler that is executed in a process must be a module level function,
+        it gets the request without `app` key and returns JSON-serializable data
+        that is sent as JSON response
+
+        `request_schema` is validated by `request_validator_backend`: "jsonschema"
+        or "fastjsonschema" that compiles the schema into python code once.
+        Validation stops after `request_validation_max_errors` errors (0 means all errors).
+        Defaults are `settings.REQUEST_VALIDATOR` and `settings.REQUEST_VALIDATION_MAX_ERRORS`
+
+        The handler might return an async iterable (for example, async generator)
+        of JSON-serializable items, they are streamed to Aidbox as chunked JSON
+        array or as NDJSON depending on `stream_format` ("json" or "ndjson")
+        """
         if public and access_policy is not None:
             raise ValueError("Operation might be public or have access policy, not both")
 
+        if stream_format not in STREAM_FORMATS:
+            raise ValueError(f"`stream_format` must be one of {', '.join(STREAM_FORMATS)}")
+
+        executor = executor or self.settings.OPERATION_EXECUTOR
+        if executor not in OPERATION_EXECUTORS:
+            raise ValueError(f"`executor` must be one of {', '.join(OPERATION_EXECUTORS)}")
+
         request_validator = None
         if request_schema:
-            request_validator = jsonschema.Draft202012Validator(schema=request_schema)
+            request_validator = create_request_validator(
+                request_schema,
+                backend=request_validator_backend or self.settings.REQUEST_VALIDATOR,
+                max_errors=(
+                    self.settings.REQUEST_VALIDATION_MAX_ERRORS
+                    if request_validation_max_errors is None
+                    else request_validation_max_errors
+                ),
+            )
 
         def wrap(func):
             if not isinstance(path, list):
@@ -177,11 +361,7 @@ class SDK:
                 elif isinstance(p, dict):
                     _str_path.append("__{}__".format(p["name"]))
 
-            def wrapped_func(operation, request):
-                if request_validator:
-                    validate_request(request_validator, request)
-                return func(operation, request)
-
+            handler = self._wrap_operation_handler(func, executor, request_validator)
             for method in methods:
                 operation_id = "{}.{}.{}.{}".format(
                     method, func.__module__, func.__name__, "_".join(_str_path)
@@ -192,7 +372,8 @@ class SDK:
                     **({"timeout": timeout} if timeout else {}),
                     **(compliance if compliance else {}),
                 }
-                self._operation_handlers[operation_id] = wrapped_func
+                self._operation_handlers[operation_id] = handler
+                self._operation_stream_formats[operation_id] = stream_format
                 if public is True:
                     self._set_access_policy_for_public_op(operation_id)
                 elif access_policy is not None:
@@ -204,6 +385,50 @@ class SDK:
     def get_operation_handler(self, operation_id):
         return self._operation_handlers.get(operation_id)
 
+    def get_operation_stream_format(self, operation_id):
+        return self._operation_stream_formats.get(operation_id, "json")
+
+    def _wrap_operation_handler(self, func, executor, request_validator):
+        """
+        Returns the handler that validates the request and runs `func` by `executor`
+        """
+
+        def wrapped_func(operation, request):
+            if request_validator:
+                validate_request(request_validator, request)
+            return func(operation, request)
+
+        if executor == "thread":
+            thread_pool = self.operation_thread_pool
+            is_async = asyncio.iscoroutinefunction(func)
+
+            async def wrapped_func_in_thread(operation, request):
+                if not is_async:
+                    result = await thread_pool.run(wrapped_func, operation, request)
+                    if asyncio.iscoroutine(result):
+                        return await result
+                    return result
+                if request_validator:
+                    await thread_pool.run(validate_request, request_validator, request)
+                return await func(operation, request)
+
+            return wrapped_func_in_thread
+
+        if executor == "process":
+            thread_pool = self.operation_thread_pool
+            process_pool = self.operation_process_pool
+            json_codec = self.json_codec
+
+            async def wrapped_func_in_process(operation, request):
+                if request_validator:
+                    await thread_pool.run(validate_request, request_validator, request)
+                result = await process_pool.run(func, operation, request)
+                return web.json_response(result, dumps=json_codec.dumps)
+
+            return wrapped_func_in_process
+
+        return wrapped_func
+
     def _set_operation_access_policy(self, operation_id, access_policy):
         if "AccessPolicy" not in self._resources:
             self._resources["AccessPolicy"] = {}
@@ -229,8 +454,15 @@ class SDK:
         )
 
 
+def _resource_id_key(event):
+    return event["resource"]["id"]
+
+
 def validate_request(request_validator, request):
-    errors = list(request_validator.iter_errors(request))
+    # `app` is injected by the SDK, it's not a part of the request
+    request = {key: value for key, value in request.items() if key != "app"}
+    with tracer.start_span("operation.validate"):
+        errors = list(request_validator.iter_errors(request))
 
     if errors:
         raise OperationOutcome(
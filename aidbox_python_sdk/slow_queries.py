@@ -0,0 +1,83 @@
+import re
+
+from sqlalchemy.sql.expression import Select
+
+# EXPLAIN ANALYZE executes the statement, so only plain reads are explained
+_READ_QUERY_RE = re.compile(r"^\s*select\b", re.IGNORECASE)
+_WRITE_KEYWORDS_RE = re.compile(r"\b(insert|update|delete|merge|truncate|into)\b", re.IGNORECASE)
+# String (including E'' escape strings) and numeric literals
+_LITERAL_RE = re.compile(
+    r"\b[Ee]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|(?<![\w$.])\d+(?:\.\d+)?(?:[Ee][-+]?\d+)?\b"
+)
+_LITERAL_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def is_read_query(sql_query):
+    return bool(_READ_QUERY_RE.match(sql_query)) and not _WRITE_KEYWORDS_RE.search(sql_query)
+
+
+def is_read_statement(statement):
+    # SELECT of SQLAlchemy (SELECT ... FOR UPDATE locks rows, so it's not a read)
+    return isinstance(statement, Select) and statement._for_update_arg is None
+
+
+def query_template(sql_query):
+    """
+    Returns the query with literal values replaced by `?`
+    (lists of literals become `(?, ...)`), so the executions of
+    the same statement with different values have the same template
+    """
+    template = _LITERAL_RE.sub("?", sql_query)
+    return _LITERAL_LIST_RE.sub("(?, ...)", template)
+
+
+class SlowQueryLog:
+    """
+    Keeps the worst `top_n` slow statements (by the max duration) grouped by
+    their template with the number of their slow executions, the latest
+    query of the template and the latest EXPLAIN plan
+    """
+
+    def __init__(self, top_n=20):
+        self.top_n = top_n
+        self._entries = {}
+
+    def record(self, sql_query, duration, rows):
+        template = query_template(sql_query)
+        entry = self._entries.get(template)
+        if entry is None:
+            if len(self._entries) >= self.top_n:
+                fastest = min(self._entries.values(), key=lambda e: e["max_duration"])
+                if fastest["max_duration"] >= duration:
+                    return None
+                del self._entries[fastest["query"]]
+            entry = self._entries[template] = {
+                "query": template,
+                "example": None,
+                "count": 0,
+                "total_duration": 0.0,
+                "max_duration": 0.0,
+                "rows": None,
+                "plan": None,
+            }
+        entry["count"] += 1
+        entry["total_duration"] += duration
+        entry["max_duration"] = max(entry["max_duration"], duration)
+        entry["rows"] = rows
+        entry["example"] = sql_query
+        return entry
+
+    def set_plan(self, template, plan):
+        entry = self._entries.get(template)
+        if entry is not None:
+            entry["plan"] = plan
+
+    def top(self):
+        return sorted(
+            (dict(entry) for entry in self._entries.values()),
+            key=lambda e: e["max_duration"],
+            reverse=True,
+        )
+
+    def reset(self):
+        self._entries = {}
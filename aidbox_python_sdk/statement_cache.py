@@ -0,0 +1,193 @@
+from collections import OrderedDict
+
+_PLACEHOLDER = "\x00"
+
+
+class _NotCacheableError(Exception):
+    pass
+
+
+class StatementCache:
+    """
+    LRU cache of compiled statement templates keyed by SQLAlchemy cache key
+
+    A statement is compiled once per structure with placeholders instead of
+    literal values, next statements of the same structure only render their
+    values as literals. Templates keep only the SQL parts, the types of
+    the values and the result columns (not the compiled statement with its values).
+    Statements that can't be cached (without cache key, with expanding
+    IN parameters, etc.) are compiled as usual
+    """
+
+    def __init__(self, dialect, max_size=500):
+        self.dialect = dialect
+        self._compiler_cls = type(
+            "TemplateCompiler", (_TemplateCompilerMixin, dialect.statement_compiler), {}
+        )
+        # Renders literal values of all templates
+        self._literal_compiler = dialect.statement_compiler(dialect, None)
+        self.max_size = max_size
+        self._templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "max_size": self.max_size,
+            "size": len(self._templates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        self._templates.clear()
+
+    def compile(self, statement):
+        return self.compile_with_columns(statement)[0]
+
+    def compile_with_columns(self, statement):
+        """
+        Returns the statement and its result columns, (keyname, type) pairs
+        """
+        cache_key = _generate_cache_key(statement) if self.max_size else None
+        if cache_key is None:
+            return self._compile(statement)
+
+        template = self._get_or_create(cache_key, self._compile_template, statement)
+        if template is False:
+            return self._compile(statement)
+        parts, positions, columns = template
+        bindparams = cache_key.bindparams
+        render_literal_value = self._literal_compiler.render_literal_value
+        rendered = list(parts)
+        for index, (position, type_) in enumerate(positions):
+            value = bindparams[position].effective_value
+            rendered[index * 2 + 1] = (
+                "NULL" if value is None else render_literal_value(value, type_)
+            )
+        return "".join(rendered), columns
+
+    def _get_or_create(self, cache_key, create, statement):
+        value = self._templates.get(cache_key.key)
+        if value is None:
+            self.misses += 1
+            value = self._templates[cache_key.key] = create(statement, cache_key)
+            if len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        else:
+            self.hits += 1
+            self._templates.move_to_end(cache_key.key)
+        return value
+
+    def _compile(self, statement):
+        compiled = statement.compile(dialect=self.dialect, compile_kwargs={"literal_binds": True})
+        return str(compiled), _get_result_columns(compiled)
+
+    def _compile_template(self, statement, cache_key):
+        try:
+            compiler = self._compiler_cls(
+                self.dialect, statement, compile_kwargs={"literal_binds": True}
+            )
+            key_positions = {}
+            for position, bindparam in enumerate(cache_key.bindparams):
+                key_positions.setdefault(bindparam.key, position)
+            positions = []
+            for bindparam in compiler.template_binds:
+                # The compiler might render a clone of the statement's bind parameter
+                # (for example, for INSERT values), the same way SQLAlchemy matches them
+                position = next(
+                    (
+                        key_positions[cloned.key]
+                        for cloned in bindparam._cloned_set
+                        if cloned.key in key_positions
+                    ),
+                    None,
+                )
+                if position is None:
+                    raise _NotCacheableError()
+                positions.append((position, bindparam.type))
+        except _NotCacheableError:
+            return False
+        # text, placeholder index, text, ..., text
+        parts = compiler.string.split(_PLACEHOLDER)
+        # Placeholders are collected in the compilation order that differs from
+        # their order in the text (for example, CTEs are rendered before the SELECT)
+        positions = [positions[int(index)] for index in parts[1::2]]
+        return parts, positions, _get_result_columns(compiler)
+
+
+class ParameterizedStatementCache(StatementCache):
+    """
+    LRU cache of statements compiled with bind parameters by the positional `dialect`
+
+    `compile` returns the statement and the list of its parameter values
+    (processed by the types' bind processors), they are converted
+    to JSON-serializable values if `json_values` is True
+    """
+
+    def __init__(self, dialect, max_size=500, *, json_values=True):
+        super().__init__(dialect, max_size)
+        self.json_values = json_values
+
+    def compile(self, statement):
+        return self.compile_with_columns(statement)[:2]
+
+    def compile_with_columns(self, statement):
+        cache_key = _generate_cache_key(statement) if self.max_size else None
+        if cache_key is None:
+            compiled = statement.compile(dialect=self.dialect)
+            params = compiled.construct_params()
+        else:
+            compiled = self._get_or_create(cache_key, self._compile_bound, statement)
+            params = compiled.construct_params(extracted_parameters=cache_key.bindparams)
+        # Expands IN parameters
+        state = compiled.construct_expanded_state(params)
+        processors = {**compiled._bind_processors, **state.processors}
+        values = []
+        for name in state.positiontup:
+            value = state.parameters[name]
+            if name in processors and value is not None:
+                value = processors[name](value)
+            values.append(_to_json_value(value) if self.json_values else value)
+        return state.statement, values, _get_result_columns(compiled)
+
+    def _compile_bound(self, statement, cache_key):
+        return self.dialect.statement_compiler(self.dialect, statement, cache_key=cache_key)
+
+
+def _generate_cache_key(statement):
+    # Cache keys are available since SQLAlchemy 1.4
+    generate_cache_key = getattr(statement, "_generate_cache_key", None)
+    return generate_cache_key() if generate_cache_key else None
+
+
+def _get_result_columns(compiled):
+    return [(column.keyname, column.type) for column in getattr(compiled, "_result_columns", ())]
+
+
+def _to_json_value(value):
+    if value is None or isinstance(value, (str, int, float, bool, list, dict)):
+        return value
+    # datetime, Decimal, UUID, etc.
+    return str(value)
+
+
+class _TemplateCompilerMixin:
+    # Renders placeholders instead of literal values
+    def __init__(self, *args, **kwargs):
+        self.template_binds = []
+        super().__init__(*args, **kwargs)
+
+    def render_literal_bindparam(self, bindparam, *args, **kwargs):
+        if (
+            args
+            or "render_literal_value" in kwargs
+            or bindparam.expanding
+            # Values passed to `.params()` (SQLAlchemy 2.1+) are not a part of the cache key
+            or bindparam.key in getattr(self, "_collected_params", ())
+        ):
+            raise _NotCacheableError()
+        self.template_binds.append(bindparam)
+        return f"{_PLACEHOLDER}{len(self.template_binds) - 1}{_PLACEHOLDER}"
@@ -0,0 +1,66 @@
+import json
+import logging
+
+from aiohttp import web
+
+logger = logging.getLogger("aidbox_sdk")
+
+STREAM_FORMATS = ("json", "ndjson")
+_CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+# Encoded items are written to the response by chunks of this size
+_CHUNK_SIZE = 64 * 1024
+
+
+def is_async_iterable(obj):
+    return hasattr(obj, "__aiter__")
+
+
+async def stream_response(request, items, *, stream_format="json", dumps=json.dumps):
+    """
+    Streams items of async iterable as chunked JSON array or NDJSON
+
+    The first item is fetched before the response is prepared, so errors
+    (for example, OperationOutcome) raised before it are handled as usual.
+    Errors raised after that abort the response
+    """
+    if stream_format not in STREAM_FORMATS:
+        raise ValueError(f"Stream format must be one of {', '.join(STREAM_FORMATS)}")
+    iterator = items.__aiter__()
+    try:
+        first_item = await iterator.__anext__()
+    except StopAsyncIteration:
+        return web.Response(
+            text="[]" if stream_format == "json" else "",
+            content_type=_CONTENT_TYPES[stream_format],
+        )
+
+    response = web.StreamResponse(headers={"Content-Type": _CONTENT_TYPES[stream_format]})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    if stream_format == "json":
+        prefix, separator, suffix = "[", ",", "]"
+    else:
+        prefix, separator, suffix = "", "\n", "\n"
+    chunk = [prefix, dumps(first_item)]
+    chunk_size = len(chunk[1])
+    try:
+        async for item in iterator:
+            encoded = dumps(item)
+            chunk.append(separator)
+            chunk.append(encoded)
+            chunk_size += len(encoded)
+            if chunk_size >= _CHUNK_SIZE:
+                await response.write("".join(chunk).encode())
+                chunk = []
+                chunk_size = 0
+    except Exception:
+        logger.exception("Streaming response is aborted")
+        raise
+    chunk.append(suffix)
+    await response.write("".join(chunk).encode())
+    await response.write_eof()
+    return response
@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import logging
+from collections import deque
+
+logger = logging.getLogger("aidbox_sdk")
+
+
+class _SubscriptionTask:
+    __slots__ = ("coalescing_key", "coro", "key", "version")
+
+    def __init__(self, coro, key=None, coalescing_key=None, version=None):
+        self.coro = coro
+        self.key = key
+        self.coalescing_key = coalescing_key
+        self.version = version
+
+
+class SubscriptionExecutor:
+    """
+    Runs subscription handlers in a bounded pool of workers
+
+    At most `max_concurrency` handlers are executed at the same time and
+    at most `max_queue_size` handlers are waiting for a free worker.
+    When the queue is full, `submit` waits up to `queue_timeout` seconds
+    for a free slot (it delays the ack to Aidbox) and then gives up,
+    so the caller is able to answer with a retryable status
+
+    Handlers submitted with the same `key` are executed strictly in the
+    order of submission, handlers with different keys run in parallel
+
+    A handler submitted with `coalescing_key` replaces the waiting handler
+    with the same `coalescing_key` if its `version` is not older,
+    so only the latest one is executed. It's ordered by `coalescing_key`
+    unless `key` is passed, so handlers wait while the previous one is running
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency=100,
+        max_queue_size=1000,
+        queue_timeout=5.0,
+        shutdown_timeout=30.0,
+    ):
+        if max_concurrency < 1:
+            raise ValueError("`max_concurrency` must be greater than 0")
+        if max_queue_size < 1:
+            raise ValueError("`max_queue_size` must be greater than 0")
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self._queue = None
+        self._slots = None
+        self._workers = []
+        # Waiting tasks per key, the key is present while its chain is running
+        self._keyed = {}
+        self._keyed_waiting = 0
+        # Waiting tasks that can be replaced by a newer version
+        self._coalescing = {}
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._coalesced = 0
+
+    @property
+    def is_running(self):
+        return bool(self._workers)
+
+    @property
+    def queue_depth(self):
+        return (self._queue.qsize() if self._queue else 0) + self._keyed_waiting
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self.queue_depth,
+            "in_flight": self._in_flight,
+            "active_keys": len(self._keyed),
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "coalesced": self._coalesced,
+        }
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    async def stop(self):
+        """
+        Waits for the queued handlers (up to `shutdown_timeout` seconds) and stops workers
+        """
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Subscription executor is stopped with %s queued and %s running handlers",
+                self.queue_depth,
+                self._in_flight,
+            )
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        while not self._queue.empty():
+            self._queue.get_nowait().coro.close()
+
+    async def submit(self, coro, *, key=None, coalescing_key=None, version=None):
+        """
+        Schedules subscription handler coroutine, optionally ordered by `key`
+        and coalesced by `coalescing_key`
+
+        Returns False if the queue is still full after `queue_timeout` seconds,
+        in this case the coroutine is closed without being run
+        """
+        await self.start()
+        if key is None:
+            # Otherwise idle workers start every handler at once and nothing is coalesced
+            key = coalescing_key
+        if coalescing_key is not None and coalescing_key in self._coalescing:
+            self._coalesce(self._coalescing[coalescing_key], coro, version)
+            return True
+        if self._slots.locked():
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._rejected += 1
+                coro.close()
+                return False
+        else:
+            await self._slots.acquire()
+        # Another task with the same key might be queued while we waited for a slot
+        if coalescing_key is not None and coalescing_key in self._coalescing:
+            self._slots.release()
+            self._coalesce(self._coalescing[coalescing_key], coro, version)
+            return True
+        self._submitted += 1
+        task = _SubscriptionTask(coro, key, coalescing_key, version)
+        if coalescing_key is not None:
+            self._coalescing[coalescing_key] = task
+        self._queue.put_nowait(task)
+        return True
+
+    def _coalesce(self, task, coro, version):
+        self._coalesced += 1
+        if version is not None and task.version is not None and version < task.version:
+            coro.close()
+            return
+        task.coro.close()
+        task.coro = coro
+        task.version = version
+
+    async def _worker(self):
+        while True:
+            task = await self._queue.get()
+            try:
+                if task.key is None:
+                    await self._run(task)
+                elif task.key in self._keyed:
+                    self._keyed[task.key].append(task)
+                    self._keyed_waiting += 1
+                else:
+                    await self._run_keyed(task)
+            finally:
+                self._queue.task_done()
+
+    async def _run_keyed(self, task):
+        key = task.key
+        waiting = self._keyed[key] = deque()
+        try:
+            while True:
+                await self._run(task)
+                if not waiting:
+                    break
+                task = waiting.popleft()
+                self._keyed_waiting -= 1
+        finally:
+            del self._keyed[key]
+            # Worker is cancelled on stop, drop the rest of the chain
+            self._keyed_waiting -= len(waiting)
+            for rest in waiting:
+                rest.coro.close()
+
+    async def _run(self, task):
+        self._slots.release()
+        if task.coalescing_key is not None:
+            del self._coalescing[task.coalescing_key]
+        self._in_flight += 1
+        try:
+            await task.coro
+        except Exception:
+            self._failed += 1
+            logger.exception("Subscription handler failed")
+        else:
+            self._completed += 1
+        finally:
+            self._in_flight -= 1
+
+
+class SubscriptionBatcher:
+    """
+    Collects subscription events into batches
+
+    The first event of a batch waits until the batch has `batch_size` events
+    or `max_wait_ms` milliseconds passed and gets the whole batch,
+    the rest of the events get None
+    """
+
+    def __init__(self, *, batch_size, max_wait_ms):
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self._events = []
+        self._full = None
+
+    async def add(self, event):
+        if self._full is not None:
+            self._events.append(event)
+            if len(self._events) >= self.batch_size:
+                self._full.set_result(None)
+                self._detach()
+            return None
+
+        events = self._events = [event]
+        full = self._full = asyncio.get_running_loop().create_future()
+        if len(events) < self.batch_size:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(asyncio.shield(full), self.max_wait_ms / 1000)
+        if self._full is full:
+            self._detach()
+        return events
+
+    def _detach(self):
+        self._events = []
+        self._full = None
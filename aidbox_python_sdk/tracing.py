@@ -0,0 +1,184 @@
+import contextvars
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+SPAN_EXPORTERS = ("memory", "file")
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_current_span = contextvars.ContextVar("aidbox_sdk_current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, *, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.start_time = time.time()
+        self.end_time = None
+        self._started_at = time.perf_counter()
+        self.duration = None
+
+    @property
+    def traceparent(self):
+        """
+        W3C Trace Context `traceparent` header value
+        """
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started_at
+        self.end_time = self.start_time + self.duration
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    traceparent = None
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class InMemorySpanExporter:
+    """
+    Keeps the last `max_spans` finished spans
+    """
+
+    def __init__(self, max_spans=10000):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def clear(self):
+        self.spans.clear()
+
+    def close(self):
+        pass
+
+
+class FileSpanExporter:
+    """
+    Appends finished spans to the file as JSON lines
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a")  # noqa: SIM115
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def create_span_exporter(name, *, path=None, max_spans=10000):
+    if name not in SPAN_EXPORTERS:
+        raise ValueError(f"Span exporter must be one of {', '.join(SPAN_EXPORTERS)}")
+    if name == "file":
+        return FileSpanExporter(path)
+    return InMemorySpanExporter(max_spans)
+
+
+class Tracer:
+    """
+    Minimal tracer: spans are kept in a context variable, so they are nested
+    by the call chain (including tasks and `sdk.operation_thread_pool` threads)
+    and finished spans are passed to the exporter
+
+    Tracing is disabled (spans are not created) until an exporter is configured
+    """
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def configure(self, exporter):
+        if self.exporter is not None and self.exporter is not exporter:
+            self.exporter.close()
+        self.exporter = exporter
+
+    @contextmanager
+    def start_span(self, name, *, attributes=None, parent=None, traceparent=None):
+        """
+        Starts a child span of `parent` (the current span by default)
+        or of the remote span defined by `traceparent` header value
+        """
+        if self.exporter is None:
+            yield _NOOP_SPAN
+            return
+
+        if parent is None:
+            parent = _current_span.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = parse_traceparent(traceparent)
+        span = Span(name, trace_id=trace_id, parent_id=parent_id, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.status = "error"
+            span.set_attribute("error.type", type(exc).__name__)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            self.exporter.export(span)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def parse_traceparent(traceparent):
+    """
+    Returns (trace_id, parent_id) from `traceparent` header value
+    or a new trace id if it's missing or invalid
+    """
+    match = _TRACEPARENT_RE.match(traceparent or "")
+    if match is None:
+        return f"{random.getrandbits(128):032x}", None
+    return match.group(1), match.group(2)
+
+
+tracer = Tracer()
@@ -0,0 +1,74 @@
+from collections import deque
+from itertools import islice
+
+import jsonschema
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+REQUEST_VALIDATORS = ("jsonschema", "fastjsonschema")
+# `$schema` values supported by fastjsonschema
+_FASTJSONSCHEMA_DRAFTS = ("draft-04", "draft-06", "draft-07")
+
+
+class JSONSchemaRequestValidator:
+    """
+    Request validator based on `jsonschema.Draft202012Validator`
+
+    It stops after `max_errors` errors if it's set
+    """
+
+    def __init__(self, schema, *, max_errors=None):
+        self._validator = jsonschema.Draft202012Validator(schema=schema)
+        self.max_errors = max_errors
+
+    def iter_errors(self, request):
+        errors = self._validator.iter_errors(request)
+        if self.max_errors:
+            return islice(errors, self.max_errors)
+        return errors
+
+
+class FastJSONSchemaRequestValidator:
+    """
+    Request validator based on the code generated by `fastjsonschema`
+
+    The schema is compiled once on creation, it supports drafts 04, 06 and 07
+    (a schema without `$schema` is validated as draft 07) and it always stops
+    on the first error. Error messages differ from jsonschema ones
+    """
+
+    def __init__(self, schema):
+        if fastjsonschema is None:
+            raise ImportError(
+                "fastjsonschema is not installed, install aidbox-python-sdk[fastjsonschema]"
+            )
+        declared_schema = schema.get("$schema", "") if isinstance(schema, dict) else ""
+        if declared_schema and not any(
+            draft in declared_schema for draft in _FASTJSONSCHEMA_DRAFTS
+        ):
+            raise ValueError(f"fastjsonschema doesn't support {declared_schema} schema")
+        self._exception_class = fastjsonschema.JsonSchemaValueException
+        self._validate = fastjsonschema.compile(schema)
+
+    def iter_errors(self, request):
+        try:
+            self._validate(request)
+        except self._exception_class as exc:
+            # The first item of the path is the name of the validated variable
+            yield jsonschema.ValidationError(exc.message, path=deque(exc.path[1:]))
+
+
+def create_request_validator(schema, *, backend="jsonschema", max_errors=None):
+    if backend not in REQUEST_VALIDATORS:
+        raise ValueError(f"Request validator must be one of {', '.join(REQUEST_VALIDATORS)}")
+    if backend == "fastjsonschema":
+        if max_errors:
+            raise ValueError(
+                "fastjsonschema validator always stops on the first error, "
+                "it can't be used with `request_validation_max_errors`"
+            )
+        return FastJSONSchemaRequestValidator(schema)
+    return JSONSchemaRequestValidator(schema, max_errors=max_errors)
@@ -129,6 +129,12 @@ async def daily_patient_report(operation, request):
     return web.json_response({"type": "report", "success": "Ok", "msg": "Response from APP"})
 
 
+@sdk.operation(["GET"], ["$stream-test"])
+async def stream_test_op(operation, request):
+    for index in range(int(request["params"].get("count", 3))):
+        yield {"index": index}
+
+
 async def get_app_ids(db: DBProxy):
     app = db.App
     return await db.alchemy(select(app.c.id))
@@ -154,6 +160,25 @@ async def observation_custom_op(operation, request):
     return {"message": "Observation custom operation response"}
 
 
+@sdk.operation(
+    ["POST"],
+    ["$request-schema-test"],
+    request_schema={
+        "required": ["resource"],
+        "properties": {
+            "resource": {
+                "type": "object",
+                "required": ["name", "count"],
+                "properties": {"name": {"type": "string"}, "count": {"type": "number"}},
+            }
+        },
+    },
+    request_validation_max_errors=1,
+)
+async def request_schema_test_op(operation, request):
+    return web.json_response(request["resource"])
+
+
 @sdk.operation(
     ["POST"],
     ["$operation-outcome-test"],
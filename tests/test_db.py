@@ -0,0 +1,329 @@
+import asyncio
+from array import array
+
+import pytest
+from aiohttp import web
+from sqlalchemy import func, select, update
+from sqlalchemy.sql.expression import Select
+
+from aidbox_python_sdk import db as db_module
+from aidbox_python_sdk.db import DBProxy
+from aidbox_python_sdk.settings import Settings
+
+
+def _make_settings(**custom_settings):
+    return Settings(
+        **{
+            "APP_INIT_CLIENT_ID": "root",
+            "APP_INIT_CLIENT_SECRET": "secret",
+            "APP_INIT_URL": "http://aidbox:8080",
+            "APP_ID": "app-test",
+            "APP_SECRET": "secret",
+            "APP_URL": "http://app:8081",
+            "APP_PORT": 8081,
+            "AIO_HOST": "0.0.0.0",
+            "AIO_PORT": 8081,
+            **custom_settings,
+        }
+    )
+
+
+def test_parameterized_queries_require_sqlalchemy_2(monkeypatch):
+    monkeypatch.setattr(db_module, "BindTyping", None)
+    # Literal queries still work
+    DBProxy(_make_settings())
+    with pytest.raises(ImportError, match=r"SQLAlchemy 2\.0"):
+        DBProxy(_make_settings(DB_PARAMETERIZED_QUERIES=True))
+
+
+class _FakePsql:
+    """
+    Executes `$psql` requests like Aidbox: statements are executed one by one
+    until the first failed one (a statement that contains "fail")
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.replica_requests = []
+        # Results of the next requests (instead of the statements' results)
+        self.pages = []
+
+    async def handler(self, request):
+        data = await request.json()
+        execute = request.query.get("execute") == "true"
+        requests = self.replica_requests if request.path.startswith("/replica") else self.requests
+        requests.append((data["query"], execute))
+        if self.pages:
+            return web.json_response([{"status": "success", "result": self.pages.pop(0)}])
+        results = []
+        for statement in data["query"].split(";\n"):
+            if "fail" in statement:
+                results.append({"status": "error", "error": f"failed: {statement}"})
+                break
+            result = None if execute else [{"statement": statement}]
+            results.append({"status": "success", "result": result})
+        return web.json_response(results)
+
+
+async def _start_db(aiohttp_server, **custom_settings):
+    psql = _FakePsql()
+    app = web.Application()
+    app.router.add_post("/$psql", psql.handler)
+    app.router.add_post("/replica/$psql", psql.handler)
+    server = await aiohttp_server(app)
+    url = str(server.make_url("")).rstrip("/")
+    db = DBProxy(
+        _make_settings(
+            APP_INIT_URL=url,
+            **{
+                key: value.format(url=url) if isinstance(value, str) else value
+                for key, value in custom_settings.items()
+            },
+        ),
+        _table_cache={
+            "Patient": {"table_name": "patient"},
+            "PatientHistory": {"table_name": "patient_history"},
+        },
+    )
+    await db.initialize()
+    return db, psql
+
+
+@pytest.fixture
+async def fake_psql(aiohttp_server):
+    db, psql = await _start_db(aiohttp_server)
+    yield db, psql
+    await db.deinitialize()
+
+
+@pytest.fixture
+async def fake_replica(aiohttp_server):
+    db, psql = await _start_db(aiohttp_server, DB_REPLICA_URL="{url}/replica")
+    yield db, psql
+    await db.deinitialize()
+
+
+@pytest.mark.asyncio
+async def test_batch_results(fake_psql):
+    db, psql = fake_psql
+    async with db.batch() as batch:
+        first = batch.raw_sql("SELECT 1;")
+        failed = batch.raw_sql("SELECT fail")
+        last = batch.raw_sql("SELECT 3")
+
+    assert psql.requests == [("SELECT 1;\nSELECT fail;\nSELECT 3", False)]
+    assert batch.results[first].get() == [{"statement": "SELECT 1"}]
+    assert batch.results[failed].error.args[0]["error"] == "failed: SELECT fail"
+    assert batch.results[last].error.args[0]["error"] == "Not executed"
+
+
+@pytest.mark.asyncio
+async def test_batch_execute_flags(fake_psql):
+    db, psql = fake_psql
+    async with db.batch() as batch:
+        batch.raw_sql("UPDATE patient SET txid = 1", execute=True)
+        batch.raw_sql("DELETE FROM patient", execute=True)
+    assert psql.requests == [("UPDATE patient SET txid = 1;\nDELETE FROM patient", True)]
+    assert [result.get() for result in batch.results] == [None, None]
+
+    # A SELECT would return nothing if it's executed with execute=true
+    batch = db.batch()
+    batch.raw_sql("SELECT 1")
+    batch.raw_sql("UPDATE patient SET txid = 1", execute=True)
+    with pytest.raises(ValueError, match="can't be mixed"):
+        await batch.execute()
+    assert len(psql.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_transaction_requires_asyncpg(fake_psql):
+    db, psql = fake_psql
+    # A separate ROLLBACK request might be executed on another connection of Aidbox pool
+    with pytest.raises(ValueError, match="asyncpg"):
+        db.batch(transaction=True)
+    assert psql.requests == []
+
+
+@pytest.mark.asyncio
+async def test_batch_is_not_atomic_via_psql(fake_psql):
+    db, psql = fake_psql
+    async with db.batch() as batch:
+        batch.raw_sql("SELECT 1")
+        batch.raw_sql("SELECT fail")
+        batch.raw_sql("SELECT 3")
+
+    assert psql.requests == [("SELECT 1;\nSELECT fail;\nSELECT 3", False)]
+    assert batch.results[0].get() == [{"statement": "SELECT 1"}]
+    assert [result.error.args[0]["error"] for result in batch.results[1:]] == [
+        "failed: SELECT fail",
+        "Not executed",
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("prefetch", [True, False])
+async def test_iterate(fake_psql, prefetch):
+    db, psql = fake_psql
+    psql.pages = [
+        [{"id": "a", "txid": 1}, {"id": "b", "txid": 2}],
+        [{"id": "c", "txid": 3}],
+    ]
+    rows = [row async for row in db.iterate(db.Patient, page_size=2, prefetch=prefetch)]
+
+    assert [row["id"] for row in rows] == ["a", "b", "c"]
+    queries = [query for query, _ in psql.requests]
+    assert len(queries) == 2
+    assert queries[0].endswith("ORDER BY patient.id \n LIMIT 2")
+    assert "WHERE patient.id > 'b'" in queries[1]
+
+
+@pytest.mark.asyncio
+async def test_iterate_history_by_txid(fake_psql):
+    db, psql = fake_psql
+    # Versions of the same resource
+    psql.pages = [
+        [{"id": "a", "txid": 1}, {"id": "a", "txid": 2}],
+        [{"id": "a", "txid": 3}],
+    ]
+    rows = [row async for row in db.iterate(db.PatientHistory, page_size=2)]
+
+    assert [row["txid"] for row in rows] == [1, 2, 3]
+    queries = [query for query, _ in psql.requests]
+    assert "ORDER BY patient_history.txid, patient_history.id" in queries[0]
+    assert "WHERE (patient_history.txid, patient_history.id) > (2, 'a')" in queries[1]
+
+    with pytest.raises(ValueError, match="History table"):
+        await db.iterate(db.PatientHistory, order_by="id").__anext__()
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert(fake_psql):
+    db, psql = fake_psql
+    psql.pages = [
+        [{"status": "created"}, {"status": "updated"}],
+        [{"status": "recreated"}],
+    ]
+    rows = [
+        {"id": "a", "resource": {"v": 1}},
+        {"id": "b", "resource": {"v": 1}},
+        {"id": "a", "resource": {"v": 2}},
+        {"id": "c", "resource": {"v": 1}},
+    ]
+    counts = await db.bulk_upsert(db.Patient, rows, chunk_size=2, concurrency=1)
+
+    assert counts == {"created": 1, "updated": 1, "recreated": 1}
+    queries = [query for query, _ in psql.requests]
+    # The duplicate of "a" is dropped, its last version is written
+    assert len(queries) == 2
+    assert "('a', nextval('transaction_id_seq'), 'Patient', 'created', '{\"v\": 2}')" in queries[0]
+    assert "'b'" in queries[0]
+    assert "'c'" in queries[1]
+    assert (
+        "status = CASE WHEN (patient.status = 'deleted') THEN 'recreated' ELSE 'updated' END"
+        in queries[0]
+    )
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_builds_statements_in_workers(fake_psql, monkeypatch):
+    db, _ = fake_psql
+    built = []
+    written = []
+    pending = []
+    original_insert = db_module.postgresql_insert
+
+    def postgresql_insert(table):
+        built.append(table)
+        return original_insert(table)
+
+    async def alchemy(statement):
+        # Statements that are built but not yet written
+        pending.append(len(built) - len(written))
+        await asyncio.sleep(0.01)
+        written.append(statement)
+        return [{"status": "created"}] * 2
+
+    monkeypatch.setattr(db_module, "postgresql_insert", postgresql_insert)
+    monkeypatch.setattr(db, "alchemy", alchemy)
+    rows = [{"id": str(index), "resource": {}} for index in range(20)]
+    counts = await db.bulk_upsert(db.Patient, rows, chunk_size=2, concurrency=3)
+
+    assert counts == {"created": 20, "updated": 0, "recreated": 0}
+    assert len(built) == 10
+    assert max(pending) <= 3
+
+
+@pytest.mark.asyncio
+async def test_replica_routing(fake_replica):
+    db, psql = fake_replica
+    await db.alchemy(select(db.Patient.c.id))
+    await db.raw_sql("SELECT 1", read_only=True)
+    rows = db.stream(select(db.Patient.c.id))
+    await rows.__anext__()
+    await rows.aclose()
+    assert [query for query, _ in psql.replica_requests] == [
+        "SELECT patient.id \nFROM patient",
+        "SELECT 1",
+        "SELECT patient.id \nFROM patient",
+    ]
+
+    # SQL text might have side effects, so it's routed only explicitly
+    await db.raw_sql("SELECT nextval('transaction_id_seq')")
+    await db.alchemy(select(db.Patient.c.id).with_for_update())
+    await db.alchemy(select(func.nextval("transaction_id_seq")), read_only=False)
+    await db.alchemy(update(db.Patient).values(txid=1), execute=True)
+    with db.read_your_writes():
+        await db.alchemy(select(db.Patient.c.id))
+    assert len(psql.replica_requests) == 3
+    assert len(psql.requests) == 5
+
+
+@pytest.mark.asyncio
+async def test_batch_replica_routing(fake_replica):
+    db, psql = fake_replica
+    async with db.batch() as batch:
+        batch.alchemy(select(db.Patient.c.id))
+        batch.raw_sql("SELECT 1", read_only=True)
+    async with db.batch() as batch:
+        batch.alchemy(select(db.Patient.c.id))
+        batch.raw_sql("SELECT 1")
+    async with db.batch() as batch:
+        # Statements with `execute` aren't routed to the replica
+        batch.raw_sql("UPDATE patient SET txid = 1", execute=True, read_only=True)
+
+    assert psql.replica_requests == [("SELECT patient.id \nFROM patient;\nSELECT 1", False)]
+    assert len(psql.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_measures_only_waiting_for_rows(aiohttp_server):
+    db, psql = await _start_db(aiohttp_server, DB_SLOW_QUERY_THRESHOLD=0.05)
+    try:
+        psql.pages = [[{"id": "a"}, {"id": "b"}]]
+        async for _ in db.stream("SELECT id FROM patient"):
+            # Slow processing of rows isn't a slow query
+            await asyncio.sleep(0.05)
+        assert db.slow_queries() == []
+    finally:
+        await db.deinitialize()
+
+
+@pytest.mark.asyncio
+async def test_columnar_uses_cached_compile(fake_psql, monkeypatch):
+    db, psql = fake_psql
+    statement = select(db.Patient.c.status, func.count().label("count")).group_by(
+        db.Patient.c.status
+    )
+    psql.pages = [[{"status": "created", "count": 2}], [{"status": "created", "count": 3}]]
+    assert await db.alchemy(statement, columnar=True, parameterized=False) == {
+        "status": ["created"],
+        "count": array("q", [2]),
+    }
+
+    def compile_statement(*args, **kwargs):
+        raise AssertionError("The statement is compiled again")
+
+    monkeypatch.setattr(Select, "compile", compile_statement)
+    columns = await db.alchemy(statement, columnar=True, parameterized=False)
+    assert columns["count"] == array("q", [3])
+    assert db.statement_cache_stats()["hits"] == 1
@@ -0,0 +1,217 @@
+import datetime
+import decimal
+import json
+import os
+import uuid
+
+import pytest
+
+from aidbox_python_sdk import db_asyncpg
+from aidbox_python_sdk.db import DBProxy, row_to_resource
+from aidbox_python_sdk.db_asyncpg import AsyncpgBackend, _record_to_row
+from aidbox_python_sdk.exceptions import AidboxDBException
+from aidbox_python_sdk.json_codec import get_json_codec
+
+from .test_db import _make_settings
+
+
+def test_record_values_are_converted_to_json():
+    utc = datetime.timezone.utc
+    record = {
+        "id": "p1",
+        "txid": 10,
+        "ts": datetime.datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=utc),
+        "cts": datetime.datetime(
+            2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=3))
+        ),
+        "resource_type": "Patient",
+        "status": "created",
+        "resource": {"birthDate": "2000-01-01"},
+        "amount": decimal.Decimal("10.50"),
+        "count": decimal.Decimal("3"),
+        "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        "day": datetime.date(2024, 1, 2),
+        "dates": [datetime.date(2024, 1, 2), None],
+        "data": b"\x01\xff",
+        "flag": True,
+    }
+    row = _record_to_row(record)
+
+    assert row == {
+        "id": "p1",
+        "txid": 10,
+        "ts": "2024-01-02T03:04:05.123456Z",
+        "cts": "2024-01-02T03:04:05+03:00",
+        "resource_type": "Patient",
+        "status": "created",
+        "resource": {"birthDate": "2000-01-01"},
+        "amount": 10.5,
+        "count": 3,
+        "uuid": "12345678-1234-5678-1234-567812345678",
+        "day": "2024-01-02",
+        "dates": ["2024-01-02", None],
+        "data": "\\x01ff",
+        "flag": True,
+    }
+    resource = row_to_resource(row)
+    assert resource["meta"]["lastUpdated"] == "2024-01-02T03:04:05.123456Z"
+    json.dumps(resource)
+
+
+def test_backend_requires_asyncpg(monkeypatch):
+    monkeypatch.setattr(db_asyncpg, "asyncpg", None)
+    with pytest.raises(ImportError, match="aidbox-python-sdk"):
+        AsyncpgBackend("postgresql://localhost/aidbox", json_codec=get_json_codec())
+
+
+# Integration tests with a real Postgres, see `test-db` service in docker-compose.yaml
+DB_DSN = os.getenv("DB_DSN")
+
+requires_db = pytest.mark.skipif(
+    not DB_DSN or db_asyncpg.asyncpg is None, reason="DB_DSN is not set or asyncpg is not installed"
+)
+
+
+@pytest.fixture
+async def backend():
+    # A single connection, so prepared statements are reused by the following queries
+    backend = AsyncpgBackend(DB_DSN, json_codec=get_json_codec(), min_size=1, max_size=1)
+    await backend.initialize()
+    await backend.fetch(
+        "DROP TABLE IF EXISTS sdk_test; CREATE TABLE sdk_test (id text PRIMARY KEY, resource jsonb)",
+        execute=True,
+    )
+    yield backend
+    await backend.fetch("DROP TABLE sdk_test", execute=True)
+    await backend.deinitialize()
+
+
+@requires_db
+@pytest.mark.asyncio
+async def test_fetch(backend):
+    rows = await backend.fetch(
+        "SELECT $1::int + 1 AS x, '2024-01-02 03:04:05+00'::timestamptz AS ts", (1,)
+    )
+    assert rows == [{"x": 2, "ts": "2024-01-02T03:04:05Z"}]
+    assert await backend.fetch("INSERT INTO sdk_test VALUES ('a', '{}')", execute=True) is None
+
+    with pytest.raises(AidboxDBException) as exc:
+        await backend.fetch("SELECT * FROM unknown_table")
+    assert exc.value.args[0]["status"] == "error"
+    assert exc.value.args[0]["sqlstate"] == "42P01"
+
+
+@requires_db
+@pytest.mark.asyncio
+async def test_stream(backend):
+    rows = [
+        row
+        async for row in backend.stream(
+            "SELECT i FROM generate_series(1, $1::int) AS i", (5,), prefetch=2
+        )
+    ]
+    assert rows == [{"i": i} for i in range(1, 6)]
+
+
+@requires_db
+@pytest.mark.asyncio
+async def test_fetch_batch_commit(backend):
+    results = await backend.fetch_batch(
+        ["INSERT INTO sdk_test VALUES ('a', '{}')", "SELECT id FROM sdk_test"],
+        execute=[True, False],
+        transaction=True,
+    )
+    assert results == [
+        {"status": "success", "result": None},
+        {"status": "success", "result": [{"id": "a"}]},
+    ]
+    assert await backend.fetch("SELECT id FROM sdk_test") == [{"id": "a"}]
+
+
+@requires_db
+@pytest.mark.asyncio
+async def test_fetch_batch_rollback(backend):
+    statements = [
+        "INSERT INTO sdk_test VALUES ('a', '{}')",
+        "INSERT INTO sdk_test VALUES ('a', '{}')",
+        "INSERT INTO sdk_test VALUES ('b', '{}')",
+    ]
+    results = await backend.fetch_batch(statements, execute=[True] * 3, transaction=True)
+    assert [result["status"] for result in results] == ["success", "error"]
+    assert results[1]["sqlstate"] == "23505"
+    # The first statement is rolled back, the last one isn't executed
+    assert await backend.fetch("SELECT id FROM sdk_test") == []
+
+    results = await backend.fetch_batch(statements, execute=[True] * 3)
+    assert [result["status"] for result in results] == ["success", "error", "success"]
+    assert await backend.fetch("SELECT id FROM sdk_test ORDER BY id") == [{"id": "a"}, {"id": "b"}]
+
+
+@requires_db
+@pytest.mark.asyncio
+async def test_jsonb_codec(backend):
+    resource = {"name": [{"given": ["Ivan"]}], "active": True}
+    rows = await backend.fetch(
+        "INSERT INTO sdk_test VALUES ($1, $2), ($3, $4) RETURNING resource",
+        ("a", resource, "b", json.dumps(resource)),
+    )
+    # Both python values and already serialized values (SQLAlchemy bind processors) are accepted
+    assert rows == [{"resource": resource}, {"resource": resource}]
+    rows = await backend.fetch(
+        "SELECT resource #> '{name, 0}' AS name, resource->'active' AS active FROM sdk_test"
+    )
+    assert rows[0] == {"name": {"given": ["Ivan"]}, "active": True}
+
+
+@requires_db
+@pytest.mark.asyncio
+async def test_prepared_statements_are_reused(backend):
+    query = "SELECT id FROM sdk_test WHERE id = $1"
+    for id_ in ("a", "b", "c"):
+        assert await backend.fetch(query, (id_,)) == []
+
+    rows = await backend.fetch(
+        "SELECT name FROM pg_prepared_statements WHERE statement = $1", (query,)
+    )
+    assert len(rows) == 1
+
+
+@pytest.fixture
+async def db(backend):
+    db = DBProxy(
+        _make_settings(DB_BACKEND="asyncpg", DB_DSN=DB_DSN),
+        _table_cache={"Patient": {"table_name": "sdk_test"}},
+    )
+    await db.initialize()
+    yield db
+    await db.deinitialize()
+
+
+@requires_db
+@pytest.mark.asyncio
+async def test_batch_transaction(db):
+    async with db.batch(transaction=True) as batch:
+        batch.raw_sql("INSERT INTO sdk_test VALUES ('a', '{}')", execute=True)
+        batch.raw_sql("SELECT id FROM sdk_test")
+    assert batch.results[1].get() == [{"id": "a"}]
+
+    async with db.batch(transaction=True) as batch:
+        batch.raw_sql("INSERT INTO sdk_test VALUES ('b', '{}')", execute=True)
+        batch.raw_sql("INSERT INTO sdk_test VALUES ('a', '{}')", execute=True)
+        batch.raw_sql("INSERT INTO sdk_test VALUES ('c', '{}')", execute=True)
+    assert [result.error.args[0]["error"] for result in batch.results][::2] == [
+        "Transaction is rolled back",
+        "Not executed",
+    ]
+    assert batch.results[1].error.args[0]["sqlstate"] == "23505"
+    assert await db.raw_sql("SELECT id FROM sdk_test") == [{"id": "a"}]
+
+
+@requires_db
+@pytest.mark.asyncio
+async def test_project(db):
+    resource = {"name": [{"given": ["Ivan"]}], "address": [{"city": "Kazan"}]}
+    await db.raw_sql("INSERT INTO sdk_test VALUES ($1, $2)", params=["a", resource], execute=True)
+
+    rows = await db.alchemy(db.Patient.project("name", "birthDate", city="address.0.city"))
+    assert rows == [{"id": "a", "name": resource["name"], "birthDate": None, "city": "Kazan"}]
@@ -0,0 +1,98 @@
+import math
+from array import array
+
+import pytest
+from sqlalchemy import Boolean, Float, Numeric, func, literal_column, select
+
+from aidbox_python_sdk.db import AidboxPostgresqlDialect, create_table
+from aidbox_python_sdk.db_columnar import ColumnBuilder, collect_columns, get_typecodes
+from aidbox_python_sdk.statement_cache import StatementCache
+
+Observation = create_table("observation")
+
+
+def test_typecodes_of_result_columns():
+    statement = select(
+        Observation.c.status,
+        func.count().label("count"),
+        Observation.c.txid,
+        literal_column("1.5", Float).label("float"),
+        literal_column("2.5", Numeric).label("numeric"),
+        literal_column("true", Boolean).label("flag"),
+        Observation.c.resource,
+    ).group_by(Observation.c.status)
+    cache = StatementCache(AidboxPostgresqlDialect())
+    for _ in range(2):
+        _, columns = cache.compile_with_columns(statement)
+        assert get_typecodes(columns) == [
+            ("status", None),
+            ("count", "q"),
+            ("txid", "q"),
+            ("float", "d"),
+            ("numeric", "d"),
+            ("flag", "b"),
+            ("resource", None),
+        ]
+    assert cache.stats()["hits"] == 1
+
+
+def _build(typecode, values):
+    builder = ColumnBuilder(typecode)
+    for value in values:
+        builder.append(value)
+    return builder
+
+
+def test_integer_column_becomes_float_for_null():
+    builder = _build("q", [1, 2, None, 4])
+    assert builder.typecode == "d"
+    assert builder.values[:2] == array("d", [1.0, 2.0])
+    assert math.isnan(builder.values[2])
+    assert builder.values[3] == 4.0
+
+    builder = _build("q", [1, 2.5])
+    assert builder.values == array("d", [1.0, 2.5])
+
+
+def test_column_falls_back_to_list():
+    assert _build("q", [1, "many"]).values == [1, "many"]
+    assert _build("d", [1.5, "NaN?"]).values == [1.5, "NaN?"]
+    assert _build("q", [1, 2**70]).typecode == "d"
+    assert _build(None, [[1], {"a": 1}]).values == [[1], {"a": 1}]
+
+
+async def _rows(rows):
+    for row in rows:
+        yield row
+
+
+@pytest.mark.asyncio
+async def test_collect_columns_without_numpy():
+    rows = [{"status": "final", "count": 3}, {"status": "draft", "count": None}]
+    columns = await collect_columns(
+        _rows(rows), [("status", None), ("count", "q")], use_numpy=False
+    )
+    assert columns["status"] == ["final", "draft"]
+    assert columns["count"][0] == 3.0
+    assert math.isnan(columns["count"][1])
+
+    # Columns of an empty result
+    assert await collect_columns(_rows([]), [("count", "q")], use_numpy=False) == {
+        "count": array("q")
+    }
+
+
+@pytest.mark.asyncio
+async def test_collect_columns_with_numpy():
+    np = pytest.importorskip("numpy")
+    rows = [
+        {"status": "final", "count": 3, "values": [1, 2]},
+        {"status": None, "count": 4, "values": [3]},
+    ]
+    columns = await collect_columns(
+        _rows(rows), [("status", None), ("count", "q"), ("values", None)], use_numpy=True
+    )
+    assert columns["count"].dtype == np.int64
+    assert columns["count"].tolist() == [3, 4]
+    assert columns["status"].dtype == object
+    assert columns["values"].shape == (2,)
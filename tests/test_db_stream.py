@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from aidbox_python_sdk import db_stream
+from aidbox_python_sdk.db_stream import iter_psql_rows, iter_sql_rows
+from aidbox_python_sdk.exceptions import AidboxDBException
+
+
+class _Content:
+    # aiohttp StreamReader of the response body
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start : start + chunk_size]
+
+
+async def _collect(rows):
+    return [row async for row in rows]
+
+
+_ROWS = [
+    {"id": "p1", "txid": 10, "resource": {"name": [{"given": ["Ünïcödé ✓"]}]}},
+    {"id": "p2", "txid": 12345678901234, "value": -1.5e-3, "flag": None},
+    {"id": "p3", "values": [1, 2, [3, {"a": "b"}]], "text": 'a "quoted" ] , } string'},
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 65536])
+async def test_psql_rows(chunk_size):
+    body = json.dumps(
+        [{"duration": 1, "result": _ROWS, "status": "success", "query": "SELECT"}],
+        ensure_ascii=False,
+        indent=1,
+    ).encode()
+    rows = await _collect(iter_psql_rows(_Content(body), chunk_size=chunk_size))
+    assert rows == _ROWS
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 3, 65536])
+async def test_sql_rows(chunk_size):
+    body = json.dumps([*_ROWS, 42], ensure_ascii=False).encode()
+    rows = await _collect(iter_sql_rows(_Content(body), chunk_size=chunk_size))
+    assert rows == [*_ROWS, 42]
+    assert await _collect(iter_sql_rows(_Content(b" [ ] "), chunk_size=chunk_size)) == []
+
+
+@pytest.mark.asyncio
+async def test_psql_error():
+    body = json.dumps([{"status": "error", "error": "syntax error"}]).encode()
+    with pytest.raises(AidboxDBException) as exc:
+        await _collect(iter_psql_rows(_Content(body), chunk_size=5))
+    assert exc.value.args[0]["error"] == "syntax error"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body", [b'[{"id": "p1"}, {"id": "p', b'[{"id": "p1"} {"id": "p2"}]'])
+async def test_invalid_response(body):
+    with pytest.raises(AidboxDBException):
+        await _collect(iter_sql_rows(_Content(body), chunk_size=4))
+
+
+@pytest.mark.asyncio
+async def test_large_row_is_decoded_few_times(monkeypatch):
+    calls = []
+
+    class _CountingDecoder:
+        def raw_decode(self, s, idx=0):
+            calls.append(len(s) - idx)
+            return json.JSONDecoder().raw_decode(s, idx)
+
+    monkeypatch.setattr(db_stream, "_decoder", _CountingDecoder())
+    row = {"id": "large", "resource": {"text": "x" * 1_000_000}}
+    body = json.dumps([row, {"id": "small"}]).encode()
+    rows = await _collect(iter_sql_rows(_Content(body), chunk_size=1024))
+
+    assert rows == [row, {"id": "small"}]
+    # The buffer is doubled between attempts instead of growing by a chunk
+    assert len(calls) < 20
+    assert sum(calls) < 4 * len(body)
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import threading
+
+import pytest
+from aiohttp import web
+
+from aidbox_python_sdk import app_keys as ak
+from aidbox_python_sdk import handlers
+from aidbox_python_sdk import sdk as sdk_module
+from aidbox_python_sdk.executors import OperationProcessPool, OperationThreadPool
+from aidbox_python_sdk.sdk import SDK
+
+from .test_db import _make_settings
+
+SCHEMA = {
+    "type": "object",
+    "required": ["resource"],
+    "properties": {"resource": {"type": "object", "required": ["name"]}},
+}
+
+
+def _get_pid(operation, request):
+    return {"pid": os.getpid(), "resource": request["resource"]}
+
+
+@pytest.mark.asyncio
+async def test_process_pool_runs_handler_in_spawned_process():
+    pool = OperationProcessPool(max_workers=1)
+    pool.start()
+    try:
+        assert pool._executor._mp_context.get_start_method() == "spawn"
+        result = await pool.run(_get_pid, {}, {"resource": {"a": 1}, "app": object()})
+    finally:
+        pool.shutdown()
+
+    assert result["pid"] != os.getpid()
+    assert result["resource"] == {"a": 1}
+    assert pool.stats()["completed"] == 1
+
+
+async def _make_client(aiohttp_client):
+    settings = _make_settings(OPERATION_EXECUTOR="thread")
+    sdk = SDK(settings)
+    app = web.Application()
+    app[ak.settings] = settings
+    app[ak.sdk] = sdk
+    app.add_routes(handlers.routes)
+    return await aiohttp_client(app), sdk
+
+
+async def _call_operation(client, sdk, resource):
+    [operation_id] = sdk._operations
+    return await client.post(
+        "/aidbox",
+        json={
+            "type": "operation",
+            "operation": {"id": operation_id},
+            "request": {"resource": resource},
+        },
+    )
+
+
+@pytest.fixture
+def validation_threads(monkeypatch):
+    threads = []
+    validate_request = sdk_module.validate_request
+
+    def recording_validate_request(request_validator, request):
+        threads.append(threading.current_thread())
+        validate_request(request_validator, request)
+
+    monkeypatch.setattr(sdk_module, "validate_request", recording_validate_request)
+    return threads
+
+
+@pytest.mark.asyncio
+async def test_sync_handler_runs_in_thread_pool(aiohttp_client, validation_threads):
+    client, sdk = await _make_client(aiohttp_client)
+    handler_threads = []
+
+    @sdk.operation(["POST"], ["sync"], request_schema=SCHEMA)
+    def sync_handler(operation, request):
+        handler_threads.append(threading.current_thread())
+        return web.json_response(request["resource"])
+
+    resp = await _call_operation(client, sdk, {"name": "a"})
+    assert resp.status == 200
+    assert await resp.json() == {"name": "a"}
+    [handler_thread] = handler_threads
+    assert handler_thread is not threading.current_thread()
+    assert handler_thread.name.startswith("aidbox-sdk-operation")
+    # The request is validated in the same thread before the handler
+    assert validation_threads == [handler_thread]
+    assert sdk.operation_thread_pool.stats()["completed"] == 1
+
+    resp = await _call_operation(client, sdk, {})
+    assert resp.status == 422
+    assert (await resp.json())["resourceType"] == "OperationOutcome"
+    assert len(handler_threads) == 1
+    sdk.operation_thread_pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_async_handler_is_validated_in_thread_pool(aiohttp_client, validation_threads):
+    client, sdk = await _make_client(aiohttp_client)
+    handler_threads = []
+
+    @sdk.operation(["POST"], ["async"], request_schema=SCHEMA)
+    async def async_handler(operation, request):
+        handler_threads.append(threading.current_thread())
+        return web.json_response(request["resource"])
+
+    resp = await _call_operation(client, sdk, {"name": "a"})
+    assert resp.status == 200
+    # The handler is executed on the event loop, only validation is offloaded
+    assert handler_threads == [threading.current_thread()]
+    [validation_thread] = validation_threads
+    assert validation_thread.name.startswith("aidbox-sdk-operation")
+
+    resp = await _call_operation(client, sdk, {"resource": "a"})
+    assert resp.status == 422
+    [issue] = (await resp.json())["issue"]
+    assert issue["code"] == "invalid"
+    assert len(handler_threads) == 1
+    assert sdk.operation_thread_pool.stats()["failed"] == 1
+    sdk.operation_thread_pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_thread_pool_stats():
+    pool = OperationThreadPool(max_workers=1)
+    release = threading.Event()
+
+    def fail():
+        raise ValueError("Failed")
+
+    blocked = asyncio.ensure_future(pool.run(release.wait))
+    queued = asyncio.ensure_future(pool.run(lambda value: value * 2, 21))
+    while pool.stats()["running"] == 0:
+        await asyncio.sleep(0.001)
+    assert pool.stats() == {
+        "max_workers": 1,
+        "queued": 1,
+        "running": 1,
+        "completed": 0,
+        "failed": 0,
+    }
+
+    release.set()
+    assert await blocked is True
+    assert await queued == 42
+    with pytest.raises(ValueError, match="Failed"):
+        await pool.run(fail)
+    assert pool.stats() == {
+        "max_workers": 1,
+        "queued": 0,
+        "running": 0,
+        "completed": 2,
+        "failed": 1,
+    }
+    pool.shutdown()
@@ -0,0 +1,62 @@
+import json
+import logging
+
+import pytest
+
+from aidbox_python_sdk import json_codec
+from aidbox_python_sdk.db import _JSONB, AidboxPostgresqlDialect
+from aidbox_python_sdk.json_codec import JSONCodec, ORJSONCodec, get_json_codec
+
+
+def test_json_codec():
+    codec = get_json_codec("json")
+    assert type(codec) is JSONCodec
+    assert codec.name == "json"
+    assert codec.dumps({"a": [1, "ы"]}) == json.dumps({"a": [1, "ы"]})
+    assert codec.loads('{"a": 1}') == codec.loads(b'{"a": 1}') == {"a": 1}
+
+
+@pytest.mark.parametrize("name", ["orjson", "auto"])
+def test_orjson_codec(name):
+    pytest.importorskip("orjson")
+    codec = get_json_codec(name)
+    assert type(codec) is ORJSONCodec
+    assert codec.name == "orjson"
+    # str like the standard library codec
+    assert codec.dumps({"a": [1, "ы"]}) == '{"a":[1,"ы"]}'
+    assert codec.loads('{"a": 1}') == codec.loads(b'{"a": 1}') == {"a": 1}
+
+
+@pytest.mark.parametrize(("name", "warning"), [("orjson", True), ("auto", False)])
+def test_fallback_without_orjson(monkeypatch, caplog, name, warning):
+    monkeypatch.setattr(json_codec, "orjson", None)
+    with pytest.raises(ImportError, match="aidbox-python-sdk"):
+        ORJSONCodec()
+
+    with caplog.at_level(logging.WARNING, logger="aidbox_sdk"):
+        codec = get_json_codec(name)
+    assert type(codec) is JSONCodec
+    # Only the explicitly requested orjson is reported
+    assert ("orjson is not installed" in caplog.text) is warning
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError, match="json, orjson, auto"):
+        get_json_codec("ujson")
+
+
+def test_jsonb_literal_uses_dialect_serializer():
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":"), sort_keys=True)
+
+    jsonb = _JSONB()
+    value = {"b": "o'reilly", "a": 1}
+    assert (
+        jsonb.process_literal_param(value, AidboxPostgresqlDialect(json_serializer=dumps))
+        == """'{"a":1,"b":"o''reilly"}'"""
+    )
+    # The standard library json without the dialect serializer
+    assert (
+        jsonb.process_literal_param(value, AidboxPostgresqlDialect())
+        == """'{"b": "o''reilly", "a": 1}'"""
+    )
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import random
+import time
+
+import pytest
+from aiohttp import web
+
+from aidbox_python_sdk import app_keys as ak
+from aidbox_python_sdk import handlers, metrics
+from aidbox_python_sdk.loop_monitor import LoopMonitor
+from aidbox_python_sdk.sdk import SDK
+
+from .test_db import _make_settings
+
+_LAG_GAUGES = [
+    f"aidbox_sdk_event_loop_{key}_seconds" for key in ("lag_p50", "lag_p90", "lag_p99", "lag_max")
+]
+
+
+@pytest.mark.asyncio
+async def test_slow_handler_is_reported(caplog):
+    monitor = LoopMonitor(interval=0.01, slow_threshold=0.05)
+    reported = metrics.slow_handlers.get("x")
+    await monitor.start()
+    try:
+        await asyncio.sleep(0.03)
+        with caplog.at_level(logging.WARNING, logger="aidbox_sdk"), monitor.track("x"):
+            time.sleep(0.2)
+        await asyncio.sleep(0.03)
+    finally:
+        await monitor.stop()
+
+    assert not monitor.is_running
+    assert monitor.stats()["slow_handlers"] == 1
+    assert metrics.slow_handlers.get("x") == reported + 1
+    [record] = [record for record in caplog.records if "is blocked" in record.message]
+    assert "by `x`" in record.message
+    # The stack of the blocking call
+    assert "time.sleep(0.2)" in record.message
+
+
+@pytest.mark.asyncio
+async def test_untracked_code_is_reported_as_unknown():
+    monitor = LoopMonitor(interval=0.01, slow_threshold=0.05)
+    reported = metrics.slow_handlers.get("<unknown>")
+    await monitor.start()
+    try:
+        await asyncio.sleep(0.03)
+        time.sleep(0.2)
+        await asyncio.sleep(0.03)
+    finally:
+        await monitor.stop()
+
+    assert monitor.stats()["slow_handlers"] == 1
+    assert metrics.slow_handlers.get("<unknown>") == reported + 1
+
+
+def test_stats_percentiles():
+    monitor = LoopMonitor(window_size=100)
+    assert monitor.stats() == {
+        "lag_p50": 0.0,
+        "lag_p90": 0.0,
+        "lag_p99": 0.0,
+        "lag_max": 0.0,
+        "slow_handlers": 0,
+    }
+
+    lags = [index / 1000 for index in range(200)]
+    random.shuffle(lags)
+    # Only the last `window_size` lags are kept
+    monitor._lags.extend(lags)
+    window = sorted(lags[-100:])
+    assert monitor.stats() == {
+        "lag_p50": window[50],
+        "lag_p90": window[90],
+        "lag_p99": window[99],
+        "lag_max": window[99],
+        "slow_handlers": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_lag_gauges_only_while_running(aiohttp_client):
+    settings = _make_settings(LOOP_MONITOR_INTERVAL=0.01)
+    app = web.Application()
+    app[ak.settings] = settings
+    app[ak.sdk] = SDK(settings)
+    app.add_routes(handlers.routes)
+    client = await aiohttp_client(app)
+    monitor = app[ak.sdk].loop_monitor
+
+    async def render_metrics():
+        resp = await client.get("/metrics")
+        assert resp.status == 200
+        return await resp.text()
+
+    text = await render_metrics()
+    assert not any(gauge in text for gauge in _LAG_GAUGES)
+
+    await monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        lines = (await render_metrics()).splitlines()
+        for gauge in _LAG_GAUGES:
+            assert f"# TYPE {gauge} gauge" in lines
+            [value] = [line.split(" ")[1] for line in lines if line.startswith(f"{gauge} ")]
+            assert float(value) >= 0
+    finally:
+        await monitor.stop()
+
+    text = await render_metrics()
+    assert not any(gauge in text for gauge in _LAG_GAUGES)
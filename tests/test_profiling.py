@@ -0,0 +1,162 @@
+import marshal
+import pstats
+import re
+import time
+from collections import Counter
+
+import pytest
+from aiohttp import web
+
+from aidbox_python_sdk import app_keys as ak
+from aidbox_python_sdk import handlers
+from aidbox_python_sdk.profiling import DispatchProfiler
+from aidbox_python_sdk.sdk import SDK
+
+from .test_db import _make_settings
+
+
+def _busy(duration):
+    started_at = time.perf_counter()
+    while time.perf_counter() - started_at < duration:
+        pass
+
+
+@pytest.mark.parametrize(("sample_rate", "invocations"), [(0, {}), (1, {"op": 3})])
+def test_sample_rate(sample_rate, invocations):
+    profiler = DispatchProfiler(sample_rate=sample_rate)
+    for _ in range(3):
+        with profiler.profile("op"):
+            _busy(0.001)
+    assert profiler.summary() == {
+        "sample_rate": sample_rate,
+        "mode": "cprofile",
+        "invocations": invocations,
+    }
+
+
+def test_only_one_invocation_is_profiled_at_a_time():
+    profiler = DispatchProfiler(sample_rate=1)
+    with profiler.profile("outer"), profiler.profile("inner"):
+        _busy(0.001)
+    assert profiler.summary()["invocations"] == {"outer": 1}
+
+    # The guard is released after the invocation
+    with profiler.profile("inner"):
+        pass
+    assert profiler.summary()["invocations"] == {"outer": 1, "inner": 1}
+
+
+def test_dump_pstats(tmp_path):
+    profiler = DispatchProfiler(sample_rate=1)
+    for key in ("op", "op", "other"):
+        with profiler.profile(key):
+            _busy(0.001)
+
+    path = tmp_path / "op.pstats"
+    path.write_bytes(profiler.dump_pstats("op"))
+    stats = pstats.Stats(str(path))
+    [busy] = [func for func in stats.stats if func[2] == "_busy"]
+    # (primitive calls, calls, ...) are aggregated for both invocations of the key
+    assert stats.stats[busy][:2] == (2, 2)
+
+    assert marshal.loads(profiler.dump_pstats("unknown")) == {}
+    all_stats = marshal.loads(profiler.dump_pstats())
+    assert all_stats[busy][:2] == (3, 3)
+
+
+def test_dump_collapsed():
+    profiler = DispatchProfiler(sample_rate=1)
+    profiler._stacks = {
+        "op": Counter({"main;handler": 2, "main": 5}),
+        "other": Counter({"main;handler": 1}),
+    }
+    assert profiler.dump_collapsed() == "main 5\nmain;handler 3\n"
+    assert profiler.dump_collapsed("other") == "main;handler 1\n"
+    assert profiler.dump_collapsed("unknown") == ""
+
+
+def test_sampling_mode():
+    profiler = DispatchProfiler(sample_rate=1, mode="sampling", sampling_interval=0.001)
+    with profiler.profile("op"):
+        _busy(0.05)
+
+    leaves = []
+    for line in profiler.dump_collapsed("op").splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        # `function (file:line)` frames from the outermost one
+        frames = stack.split(";")
+        assert all(re.fullmatch(r"\S+ \(.+:\d+\)", frame) for frame in frames)
+        leaves.append(frames[-1])
+    assert any(leaf.startswith("_busy (") for leaf in leaves)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"sample_rate": "0.5"},
+        {"sample_rate": True},
+        {"sample_rate": 1.5},
+        {"mode": "unknown"},
+        {"mode": ["cprofile"]},
+        {"sampling_interval": 0},
+    ],
+)
+def test_configure_validates_options(options):
+    profiler = DispatchProfiler()
+    with pytest.raises(ValueError, match="must be"):
+        profiler.configure(**options)
+    assert profiler.summary()["sample_rate"] == 0
+
+
+async def _make_client(aiohttp_client, token):
+    settings = _make_settings(PROFILING_ADMIN_TOKEN=token)
+    app = web.Application()
+    app[ak.settings] = settings
+    app[ak.sdk] = SDK(settings)
+    app.add_routes(handlers.routes)
+    return await aiohttp_client(app), app[ak.sdk].profiler
+
+
+@pytest.mark.asyncio
+async def test_profiling_routes_require_token(aiohttp_client):
+    client, _ = await _make_client(aiohttp_client, "")
+    resp = await client.get("/profiling", headers={"Authorization": "Bearer "})
+    assert resp.status == 404
+
+    client, _ = await _make_client(aiohttp_client, "secret")
+    for path in ("/profiling", "/profiling/pstats", "/profiling/collapsed"):
+        assert (await client.get(path)).status == 401
+        resp = await client.get(path, headers={"Authorization": "Bearer wrong"})
+        assert resp.status == 401
+    resp = await client.post("/profiling", json={"sample_rate": 1})
+    assert resp.status == 401
+
+
+@pytest.mark.asyncio
+async def test_profiling_routes(aiohttp_client):
+    client, profiler = await _make_client(aiohttp_client, "secret")
+    headers = {"Authorization": "Bearer secret"}
+
+    resp = await client.post("/profiling", json={"sample_rate": 1}, headers=headers)
+    assert resp.status == 200
+    assert (await resp.json())["sample_rate"] == 1
+
+    for body in ({"sample_rate": "0.5"}, {"mode": 1}, [1]):
+        resp = await client.post("/profiling", json=body, headers=headers)
+        assert resp.status == 400
+    resp = await client.post("/profiling", data="{", headers=headers)
+    assert resp.status == 400
+    assert profiler.summary()["sample_rate"] == 1
+
+    with profiler.profile("op"):
+        _busy(0.001)
+    resp = await client.get("/profiling", headers=headers)
+    assert (await resp.json())["invocations"] == {"op": 1}
+    resp = await client.get("/profiling/pstats", params={"key": "op"}, headers=headers)
+    assert any(func[2] == "_busy" for func in marshal.loads(await resp.read()))
+
+    resp = await client.delete("/profiling", headers=headers)
+    assert (await resp.json())["invocations"] == {}
+    resp = await client.get("/profiling/collapsed", headers=headers)
+    assert await resp.text() == ""
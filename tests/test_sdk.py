@@ -54,6 +54,20 @@ async def test_live_health_check(client):
     assert json == {"status": "OK"}
 
 
+@pytest.mark.asyncio
+async def test_metrics(client, aidbox_client):
+    await aidbox_client.execute("signup/register/21.02.19/testvalue")
+    resp = await client.get("/metrics")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = await resp.text()
+    assert (
+        'aidbox_sdk_operation_duration_seconds_count{operation_id="POST.main.signup_register_op.'
+        'signup_register___date_____test__"}' in text
+    )
+    assert "aidbox_sdk_subscription_executor_in_flight " in text
+
+
 @pytest.mark.asyncio
 async def test_signup_reg_op(aidbox_client):
     json = await aidbox_client.execute("signup/register/21.02.19/testvalue")
@@ -192,6 +206,27 @@ async def test_aidbox_db_fixture(client, aidbox_db: DBProxy, safe_db):
     assert app_ids == [{"id": "app-test"}]
 
 
+async def test_request_schema_test_op(aidbox_client):
+    response = await aidbox_client.execute(
+        "/$request-schema-test", data={"name": "test", "count": 1}
+    )
+    assert response == {"name": "test", "count": 1}
+
+
+async def test_request_schema_test_op_stops_after_max_errors(aidbox_client):
+    with pytest.raises(OperationOutcome) as exc:
+        await aidbox_client.execute("/$request-schema-test", data={"count": "1"})
+    issues = exc.value.resource.get("issue")
+    assert len(issues) == 1
+    assert issues[0]["expression"] == ["resource"]
+    assert issues[0]["diagnostics"] == "'name' is a required property"
+
+
+async def test_stream_test_op(aidbox_client):
+    response = await aidbox_client.execute("/$stream-test", method="GET", params={"count": 5})
+    assert response == [{"index": index} for index in range(5)]
+
+
 async def test_operation_outcome_test_op(aidbox_client):
     with pytest.raises(OperationOutcome) as exc:
         await aidbox_client.execute("/$operation-outcome-test")
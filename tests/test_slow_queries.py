@@ -0,0 +1,42 @@
+from aidbox_python_sdk.slow_queries import SlowQueryLog, query_template
+
+
+def test_query_template_replaces_literals():
+    assert (
+        query_template("SELECT * FROM patient WHERE id = 'p''1' AND txid > 10 LIMIT 5")
+        == "SELECT * FROM patient WHERE id = ? AND txid > ? LIMIT ?"
+    )
+    assert (
+        query_template("SELECT t1.id FROM t1 WHERE t1.id IN ('a', 'b', 'c') AND x = $1")
+        == "SELECT t1.id FROM t1 WHERE t1.id IN (?, ...) AND x = $1"
+    )
+    assert (
+        query_template("UPDATE patient SET resource = E'{\\'a\\': 1.5e3}'::jsonb")
+        == "UPDATE patient SET resource = ?::jsonb"
+    )
+
+
+def test_slow_query_log_groups_queries_by_template():
+    log = SlowQueryLog(top_n=2)
+    log.record("SELECT * FROM patient WHERE id = 'a'", 1.0, 1)
+    log.record("SELECT * FROM patient WHERE id = 'b'", 3.0, 0)
+    log.record("SELECT count(*) FROM patient", 2.0, 1)
+    log.set_plan("SELECT * FROM patient WHERE id = ?", {"Plan": {}})
+
+    top = log.top()
+    assert [entry["query"] for entry in top] == [
+        "SELECT * FROM patient WHERE id = ?",
+        "SELECT count(*) FROM patient",
+    ]
+    assert top[0]["count"] == 2
+    assert top[0]["max_duration"] == 3.0
+    assert top[0]["example"] == "SELECT * FROM patient WHERE id = 'b'"
+    assert top[0]["plan"] == {"Plan": {}}
+
+    # The fastest template is replaced by a slower one
+    assert log.record("SELECT 1", 1.5, 1) is None
+    log.record("SELECT * FROM encounter WHERE id = 'e'", 2.5, 1)
+    assert [entry["query"] for entry in log.top()] == [
+        "SELECT * FROM patient WHERE id = ?",
+        "SELECT * FROM encounter WHERE id = ?",
+    ]
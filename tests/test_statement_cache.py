@@ -0,0 +1,208 @@
+import datetime
+import json
+
+import pytest
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, text, union_all, update
+from sqlalchemy.sql.compiler import SQLCompiler
+
+from aidbox_python_sdk.db import (
+    AidboxPostgresqlDialect,
+    create_parameterized_dialect,
+    create_table,
+)
+from aidbox_python_sdk.statement_cache import ParameterizedStatementCache, StatementCache
+
+Patient = create_table("patient")
+Encounter = create_table("encounter")
+
+
+def _statements(value):
+    # Statements of different shapes for the value set, the shapes don't depend on the values
+    name, number, flag = value
+    subquery = select(Encounter.c.resource["subject"]["id"].astext).where(Encounter.c.txid > number)
+    cte = select(Patient.c.id).where(Patient.c.resource["active"].as_boolean() == flag).cte()
+    txid_cte = select(Patient.c.id, Patient.c.txid).where(Patient.c.txid > number).cte("c")
+    return [
+        select(Patient).where(Patient.c.id == name),
+        select(Patient.c.id).where(Patient.c.txid >= number).limit(number).offset(number * 2),
+        select(Patient).where(Patient.c.resource.contains({"name": [{"given": [name]}]})),
+        select(Patient).where(Patient.c.resource["birthDate"].astext > name),
+        select(Patient).where(
+            or_(Patient.c.id == name, and_(Patient.c.txid < number, Patient.c.status == "deleted"))
+        ),
+        select(Patient).where(Patient.c.ts > datetime.datetime(2020, 1, number % 28 + 1)),
+        select(Patient.c.id, literal(name).label("value"), func.coalesce(Patient.c.txid, number)),
+        select(func.count()).where(Patient.c.id.in_(subquery)),
+        select(cte.c.id).where(cte.c.id.like(f"%{name}%")),
+        # Literals inside and outside the CTE (the CTE is rendered first)
+        select((txid_cte.c.txid + number * 2).label("x"), literal(name).label("name"))
+        .select_from(txid_cte)
+        .where(txid_cte.c.id != name),
+        union_all(
+            select(Patient.c.id).where(Patient.c.txid == number),
+            select(Encounter.c.id).where(Encounter.c.id == name),
+        ),
+        select(Patient).where(Patient.c.resource["active"].as_boolean().is_(flag)),
+        insert(Patient).values(
+            id=name, txid=number, status="created", resource={"name": name, "n": number}
+        ),
+        update(Patient)
+        .where(Patient.c.id == name)
+        .values(txid=Patient.c.txid + number, resource={"active": flag}),
+        delete(Patient).where(Patient.c.id == name).returning(Patient.c.id),
+        select(Patient).where(Patient.c.id.in_([name, "other"])),
+        select(Patient).where(text("id = :id").bindparams(id=name)),
+        Patient.project("birthDate", value=f"name.0.{name}").where(Patient.c.txid > number),
+    ]
+
+
+_VALUES = [
+    ("a", 1, True),
+    ("o'reilly", 42, False),
+    ("back\\slash", 2**40, True),
+    ("unicode ✓", 0, False),
+]
+
+
+def _compile(dialect, statement):
+    return str(statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+
+@pytest.mark.parametrize("shape", range(len(_statements(_VALUES[0]))))
+def test_cache_renders_same_sql_as_literal_binds(shape):
+    dialect = AidboxPostgresqlDialect()
+    cache = StatementCache(dialect)
+    for value in _VALUES:
+        statement = _statements(value)[shape]
+        assert cache.compile(statement) == _compile(dialect, statement)
+
+
+def test_cache_hits_and_templates_dont_keep_values():
+    dialect = AidboxPostgresqlDialect()
+    cache = StatementCache(dialect)
+    names = [f"name-{index}" for index in range(10)]
+    for name in names:
+        cache.compile(select(Patient).where(Patient.c.resource.contains({"name": name})))
+    assert cache.stats()["hits"] == len(names) - 1
+    assert cache.stats()["size"] == 1
+
+    [(parts, positions, _)] = cache._templates.values()
+    assert all(isinstance(part, str) for part in parts)
+    assert "name-" not in "".join(parts)
+    # Only positions of the values and their types
+    assert [position for position, _ in positions] == [0]
+    assert not any(isinstance(type_, SQLCompiler) for _, type_ in positions)
+
+
+def test_cache_with_none_value():
+    dialect = AidboxPostgresqlDialect()
+    cache = StatementCache(dialect)
+    for value in ("a", None):
+        statement = update(Patient).where(Patient.c.id == "a").values(resource_type=value)
+        assert cache.compile(statement) == _compile(dialect, statement)
+
+
+@pytest.mark.parametrize(
+    ("paramstyle", "json_values", "expected_sql", "expected_params", "expected_params_2"),
+    [
+        (
+            "qmark",
+            True,
+            (
+                "SELECT patient.id \nFROM patient \nWHERE patient.id IN (?, ?) AND patient.txid > ? "
+                "AND patient.resource @> ?::JSONB AND patient.ts > ?"
+            ),
+            ["a", "b", 5, '{"active": true}', "2020-01-01 00:00:00"],
+            ["c", 6, '{"active": true}', "2020-01-01 00:00:00"],
+        ),
+        (
+            "numeric_dollar",
+            False,
+            (
+                "SELECT patient.id \nFROM patient \nWHERE patient.id IN ($4, $5) "
+                "AND patient.txid > $1 AND patient.resource @> $2::JSONB AND patient.ts > $3"
+            ),
+            [5, '{"active": true}', datetime.datetime(2020, 1, 1), "a", "b"],
+            [6, '{"active": true}', datetime.datetime(2020, 1, 1), "c"],
+        ),
+    ],
+)
+def test_parameterized_cache(
+    paramstyle, json_values, expected_sql, expected_params, expected_params_2
+):
+    cache = ParameterizedStatementCache(
+        create_parameterized_dialect(json.dumps, paramstyle=paramstyle), json_values=json_values
+    )
+
+    def statement(ids, txid):
+        return select(Patient.c.id).where(
+            Patient.c.id.in_(ids),
+            Patient.c.txid > txid,
+            Patient.c.resource.contains({"active": True}),
+            Patient.c.ts > datetime.datetime(2020, 1, 1),
+        )
+
+    assert cache.compile(statement(["a", "b"], 5)) == (expected_sql, expected_params)
+    # IN list of another size is expanded by the cached statement
+    sql, params = cache.compile(statement(["c"], 6))
+    assert sql == expected_sql.replace("(?, ?)", "(?)").replace("($4, $5)", "($4)")
+    assert params == expected_params_2
+    assert cache.stats()["hits"] == 1
+
+
+def test_parameterized_cache_insert():
+    cache = ParameterizedStatementCache(create_parameterized_dialect(json.dumps))
+    statement = insert(Patient).values(id="p", txid=1, status="created", resource={"a": [1]})
+    assert cache.compile(statement) == (
+        "INSERT INTO patient (id, txid, status, resource) VALUES (?, ?, ?, ?::JSONB)",
+        ["p", 1, "created", '{"a": [1]}'],
+    )
+
+
+@pytest.mark.parametrize(
+    ("paramstyle", "expected_sql", "expected_params"),
+    [
+        (
+            None,
+            (
+                "SELECT patient.id, patient.resource -> 'name' AS name, "
+                "patient.resource #> CAST(ARRAY['address', '0', 'city'] AS TEXT[]) AS city \n"
+                "FROM patient"
+            ),
+            None,
+        ),
+        (
+            "qmark",
+            (
+                "SELECT patient.id, patient.resource -> ? AS name, "
+                "patient.resource #> CAST(ARRAY[?, ?, ?] AS TEXT[]) AS city \nFROM patient"
+            ),
+            ["name", "address", "0", "city"],
+        ),
+        (
+            "numeric_dollar",
+            (
+                "SELECT patient.id, patient.resource -> $1 AS name, "
+                "patient.resource #> CAST(ARRAY[$2, $3, $4] AS TEXT[]) AS city \nFROM patient"
+            ),
+            ["name", "address", "0", "city"],
+        ),
+    ],
+)
+def test_project(paramstyle, expected_sql, expected_params):
+    # Top-level elements are extracted by `->`, paths by `#>` with text[] (not a str parameter)
+    statement = Patient.project("name", city="address.0.city")
+    if paramstyle is None:
+        assert StatementCache(AidboxPostgresqlDialect()).compile(statement) == expected_sql
+    else:
+        cache = ParameterizedStatementCache(
+            create_parameterized_dialect(json.dumps, paramstyle=paramstyle)
+        )
+        assert cache.compile(statement) == (expected_sql, expected_params)
+
+
+def test_project_requires_paths():
+    with pytest.raises(ValueError, match="At least one path"):
+        Patient.project()
+    with pytest.raises(ValueError, match="non-empty str"):
+        Patient.project("")
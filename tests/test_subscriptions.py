@@ -0,0 +1,386 @@
+import asyncio
+import inspect
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from aidbox_python_sdk import app_keys as ak
+from aidbox_python_sdk import handlers
+from aidbox_python_sdk.sdk import SDK
+from aidbox_python_sdk.settings import Settings
+from aidbox_python_sdk.subscriptions import SubscriptionBatcher, SubscriptionExecutor
+
+
+async def _wait_for(event):
+    await event.wait()
+
+
+async def _fail():
+    raise ValueError("Failed")
+
+
+async def _record(log, value, delay=0):
+    await asyncio.sleep(delay)
+    log.append(value)
+
+
+def _make_sdk(executor):
+    settings = Settings(
+        APP_INIT_CLIENT_ID="root",
+        APP_INIT_CLIENT_SECRET="secret",
+        APP_INIT_URL="http://aidbox:8080",
+        APP_ID="app-test",
+        APP_SECRET="secret",
+        APP_URL="http://app:8081",
+        APP_PORT=8081,
+        AIO_HOST="0.0.0.0",
+        AIO_PORT=8081,
+    )
+    return SDK(settings, subscription_executor=executor)
+
+
+def _make_request(sdk):
+    app = web.Application()
+    app[ak.sdk] = sdk
+    return make_mocked_request("POST", "/", app=app)
+
+
+def _make_event(resource_id, txid):
+    return {"resource": {"resourceType": "Patient", "id": resource_id}, "tx": {"id": txid}}
+
+
+async def _settle():
+    # Lets the workers pick up the queued handlers
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_executor_runs_handlers():
+    executor = SubscriptionExecutor(max_concurrency=2)
+    log = []
+    for value in range(5):
+        assert await executor.submit(_record(log, value)) is True
+    assert await executor.submit(_fail()) is True
+    await executor.stop()
+
+    assert sorted(log) == [0, 1, 2, 3, 4]
+    stats = executor.stats()
+    assert stats["submitted"] == 6
+    assert stats["completed"] == 5
+    assert stats["failed"] == 1
+    assert stats["queue_depth"] == 0
+    assert not executor.is_running
+
+
+@pytest.mark.asyncio
+async def test_executor_limits_concurrency():
+    executor = SubscriptionExecutor(max_concurrency=2)
+    release = asyncio.Event()
+    for _ in range(5):
+        await executor.submit(_wait_for(release))
+    await _settle()
+
+    assert executor.in_flight == 2
+    assert executor.queue_depth == 3
+
+    release.set()
+    await executor.stop()
+    assert executor.stats()["completed"] == 5
+
+
+@pytest.mark.asyncio
+async def test_executor_rejects_handler_when_queue_is_full():
+    executor = SubscriptionExecutor(max_concurrency=1, max_queue_size=1, queue_timeout=0.05)
+    release = asyncio.Event()
+    assert await executor.submit(_wait_for(release)) is True
+    await _settle()
+    # Waits in the queue
+    assert await executor.submit(_wait_for(release)) is True
+
+    rejected = _wait_for(release)
+    assert await executor.submit(rejected) is False
+    assert inspect.getcoroutinestate(rejected) == inspect.CORO_CLOSED
+    assert executor.stats()["rejected"] == 1
+
+    release.set()
+    await executor.stop()
+    assert executor.stats()["completed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_executor_waits_for_free_slot():
+    executor = SubscriptionExecutor(max_concurrency=1, max_queue_size=1, queue_timeout=1.0)
+    release = asyncio.Event()
+    await executor.submit(_wait_for(release))
+    await _settle()
+    await executor.submit(_wait_for(release))
+
+    submit = asyncio.create_task(executor.submit(_wait_for(release)))
+    await _settle()
+    assert not submit.done()
+
+    release.set()
+    assert await submit is True
+    await executor.stop()
+    assert executor.stats()["completed"] == 3
+    assert executor.stats()["rejected"] == 0
+
+
+@pytest.mark.asyncio
+async def test_executor_stop_waits_for_queued_handlers():
+    executor = SubscriptionExecutor(max_concurrency=1)
+    log = []
+    for value in range(3):
+        await executor.submit(_record(log, value, delay=0.01))
+    await executor.stop()
+
+    assert log == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_executor_stop_drops_handlers_after_shutdown_timeout():
+    executor = SubscriptionExecutor(max_concurrency=1, shutdown_timeout=0.05)
+    running = _wait_for(asyncio.Event())
+    queued = _wait_for(asyncio.Event())
+    await executor.submit(running)
+    await _settle()
+    await executor.submit(queued)
+    await executor.stop()
+
+    assert not executor.is_running
+    assert inspect.getcoroutinestate(running) == inspect.CORO_CLOSED
+    assert inspect.getcoroutinestate(queued) == inspect.CORO_CLOSED
+    assert executor.stats()["completed"] == 0
+
+
+@pytest.mark.parametrize(
+    ("kwargs", "message"),
+    [
+        ({"max_concurrency": 0}, "max_concurrency"),
+        ({"max_queue_size": 0}, "max_queue_size"),
+    ],
+)
+def test_executor_validates_limits(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        SubscriptionExecutor(**kwargs)
+
+
+@pytest.mark.asyncio
+async def test_subscription_is_rejected_with_503_when_queue_is_full():
+    executor = SubscriptionExecutor(max_concurrency=1, max_queue_size=1, queue_timeout=0.05)
+    sdk = _make_sdk(executor)
+    release = asyncio.Event()
+
+    @sdk.subscription("Patient")
+    async def patient_sub(event, request):
+        await release.wait()
+
+    request = _make_request(sdk)
+    data = {"handler": "patient_sub", "event": _make_event("pt-1", 1)}
+    await handlers.subscription(request, data)
+    await _settle()
+    await handlers.subscription(request, data)
+    with pytest.raises(web.HTTPServiceUnavailable) as exc_info:
+        await handlers.subscription(request, data)
+    assert exc_info.value.headers["Retry-After"] == "1"
+
+    release.set()
+    await executor.stop()
+
+
+@pytest.mark.asyncio
+async def test_executor_runs_handlers_of_the_same_key_in_order():
+    executor = SubscriptionExecutor(max_concurrency=4)
+    log = []
+    # Earlier handlers are slower, so they would finish last without ordering
+    for value, delay in enumerate([0.04, 0.03, 0.02, 0.01]):
+        await executor.submit(_record(log, value, delay=delay), key="pt-1")
+    await executor.stop()
+
+    assert log == [0, 1, 2, 3]
+    assert executor.stats()["active_keys"] == 0
+
+
+@pytest.mark.asyncio
+async def test_executor_runs_handlers_of_different_keys_in_parallel():
+    executor = SubscriptionExecutor(max_concurrency=4)
+    release = asyncio.Event()
+    await executor.submit(_wait_for(release), key="pt-1")
+    await executor.submit(_wait_for(release), key="pt-1")
+    await executor.submit(_wait_for(release), key="pt-2")
+    await _settle()
+
+    assert executor.in_flight == 2
+    assert executor.queue_depth == 1
+    assert executor.stats()["active_keys"] == 2
+
+    release.set()
+    await executor.stop()
+    assert executor.stats()["completed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_executor_keeps_order_after_failed_handler():
+    executor = SubscriptionExecutor(max_concurrency=2)
+    log = []
+    await executor.submit(_record(log, 0, delay=0.01), key="pt-1")
+    await executor.submit(_fail(), key="pt-1")
+    await executor.submit(_record(log, 2), key="pt-1")
+    await executor.stop()
+
+    assert log == [0, 2]
+    assert executor.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ordered_subscription_is_keyed_by_resource_id():
+    sdk = _make_sdk(SubscriptionExecutor())
+
+    @sdk.subscription("Patient", ordered=True)
+    async def patient_sub(event, request):
+        pass
+
+    assert sdk.get_subscription_ordering_key("patient_sub", _make_event("pt-1", 1)) == (
+        "patient_sub",
+        "pt-1",
+    )
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_full_batch():
+    batcher = SubscriptionBatcher(batch_size=3, max_wait_ms=10000)
+    results = await asyncio.wait_for(
+        asyncio.gather(*(batcher.add(event) for event in ["a", "b", "c"])), 1
+    )
+    assert results == [["a", "b", "c"], None, None]
+
+    # The next event starts a new batch
+    results = await asyncio.wait_for(
+        asyncio.gather(*(batcher.add(event) for event in ["d", "e", "f"])), 1
+    )
+    assert results == [["d", "e", "f"], None, None]
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_batch_after_max_wait():
+    batcher = SubscriptionBatcher(batch_size=10, max_wait_ms=20)
+    first = asyncio.create_task(batcher.add("a"))
+    await _settle()
+    assert await batcher.add("b") is None
+    assert not first.done()
+
+    assert await asyncio.wait_for(first, 1) == ["a", "b"]
+    assert await asyncio.wait_for(batcher.add("c"), 1) == ["c"]
+
+
+@pytest.mark.asyncio
+async def test_batched_subscription_handler_gets_list_of_events():
+    executor = SubscriptionExecutor(max_concurrency=10)
+    sdk = _make_sdk(executor)
+    batches = []
+
+    @sdk.subscription("Patient", batch_size=2, max_wait_ms=10000)
+    async def patient_sub(events, request):
+        batches.append([event["resource"]["id"] for event in events])
+
+    request = _make_request(sdk)
+    for resource_id in ["pt-1", "pt-2", "pt-3", "pt-4"]:
+        data = {"handler": "patient_sub", "event": _make_event(resource_id, 1)}
+        await handlers.subscription(request, data)
+    await executor.stop()
+
+    assert batches == [["pt-1", "pt-2"], ["pt-3", "pt-4"]]
+
+
+def test_subscription_might_not_be_ordered_and_batched():
+    sdk = _make_sdk(SubscriptionExecutor())
+    with pytest.raises(ValueError, match="ordered or batched"):
+        sdk.subscription("Patient", ordered=True, batch_size=10)
+
+
+@pytest.mark.asyncio
+async def test_executor_coalesces_handlers_waiting_for_running_one():
+    executor = SubscriptionExecutor(max_concurrency=10)
+    log = []
+    for version in range(1, 6):
+        await executor.submit(
+            _record(log, version, delay=0.01), coalescing_key="pt-1", version=version
+        )
+        # Idle workers pick up the handler before the next one is submitted
+        await _settle()
+    await executor.stop()
+
+    assert log == [1, 5]
+    assert executor.stats()["coalesced"] == 3
+
+
+@pytest.mark.asyncio
+async def test_executor_does_not_replace_handler_by_older_version():
+    executor = SubscriptionExecutor(max_concurrency=1)
+    release = asyncio.Event()
+    log = []
+    await executor.submit(_wait_for(release), coalescing_key="pt-1", version=1)
+    await _settle()
+    await executor.submit(_record(log, 3), coalescing_key="pt-1", version=3)
+    older = _record(log, 2)
+    await executor.submit(older, coalescing_key="pt-1", version=2)
+
+    assert inspect.getcoroutinestate(older) == inspect.CORO_CLOSED
+    release.set()
+    await executor.stop()
+    assert log == [3]
+
+
+@pytest.mark.asyncio
+async def test_coalesced_subscription_processes_latest_event_of_resource():
+    executor = SubscriptionExecutor(max_concurrency=10)
+    sdk = _make_sdk(executor)
+    processed = []
+
+    @sdk.subscription("Patient", coalesce=True)
+    async def patient_sub(event, request):
+        await asyncio.sleep(0.01)
+        processed.append((event["resource"]["id"], event["tx"]["id"]))
+
+    request = _make_request(sdk)
+    for txid in range(1, 6):
+        for resource_id in ["pt-1", "pt-2"]:
+            data = {"handler": "patient_sub", "event": _make_event(resource_id, txid)}
+            await handlers.subscription(request, data)
+        await _settle()
+    await executor.stop()
+
+    assert sorted(processed) == [("pt-1", 1), ("pt-1", 5), ("pt-2", 1), ("pt-2", 5)]
+    assert executor.stats()["coalesced"] == 6
+
+
+def test_subscription_might_not_be_coalesced_and_batched():
+    sdk = _make_sdk(SubscriptionExecutor())
+    with pytest.raises(ValueError, match="coalesced or batched"):
+        sdk.subscription("Patient", coalesce=True, batch_size=10)
+
+
+@pytest.mark.asyncio
+async def test_dispatch_decodes_subscription_event(aiohttp_client):
+    executor = SubscriptionExecutor()
+    sdk = _make_sdk(executor)
+    events = []
+
+    @sdk.subscription("Patient")
+    async def patient_sub(event, request):
+        events.append(event)
+
+    app = web.Application()
+    app[ak.sdk] = sdk
+    app.add_routes(handlers.routes)
+    client = await aiohttp_client(app)
+    event = _make_event("pt-1", 1)
+    resp = await client.post(
+        "/aidbox", json={"type": "subscription", "handler": "patient_sub", "event": event}
+    )
+    assert resp.status == 200
+    await executor.stop()
+
+    assert events == [event]
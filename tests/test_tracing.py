@@ -0,0 +1,76 @@
+import inspect
+import json
+
+import pytest
+from aiohttp import web
+from fhirpy.base import AsyncClient
+
+from aidbox_python_sdk.aidboxpy import AsyncAidboxClient
+from aidbox_python_sdk.tracing import InMemorySpanExporter, create_span_exporter, tracer
+
+
+def test_in_memory_exporter_keeps_last_spans():
+    exporter = InMemorySpanExporter(max_spans=3)
+    for span in range(5):
+        exporter.export(span)
+    assert list(exporter.spans) == [2, 3, 4]
+
+    exporter.clear()
+    assert list(exporter.spans) == []
+
+    assert create_span_exporter("memory", max_spans=10).spans.maxlen == 10
+
+
+def test_overridden_fhirpy_methods_are_compatible():
+    # AsyncAidboxClient wraps private methods of fhirpy client,
+    # this test fails if fhirpy renames them or changes their signatures
+    do_request = inspect.signature(AsyncClient._do_request)
+    assert list(do_request.parameters)[:3] == ["self", "method", "path"]
+    assert inspect.iscoroutinefunction(AsyncClient._do_request)
+
+    build_request_headers = inspect.signature(AsyncClient._build_request_headers)
+    assert list(build_request_headers.parameters) == ["self"]
+
+    assert AsyncAidboxClient._do_request is not AsyncClient._do_request
+    assert AsyncAidboxClient._build_request_headers is not AsyncClient._build_request_headers
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemorySpanExporter()
+    tracer.configure(exporter)
+    yield exporter
+    tracer.configure(None)
+
+
+@pytest.mark.asyncio
+async def test_aidbox_request_span(aiohttp_server, exporter):
+    patient = {"resourceType": "Patient", "id": "p1", "name": [{"given": ["Иван"]}]}
+    headers = []
+
+    async def get_patient(request):
+        headers.append(request.headers)
+        return web.json_response(patient, dumps=lambda obj: json.dumps(obj, indent=2))
+
+    app = web.Application()
+    app.router.add_get("/Patient/p1", get_patient)
+    server = await aiohttp_server(app)
+    client = AsyncAidboxClient(str(server.make_url("")).rstrip("/"), authorization="Basic x")
+
+    with tracer.start_span("operation") as parent:
+        assert await client.execute("Patient/p1", method="get") == patient
+
+    request_span, operation_span = exporter.spans
+    assert operation_span is parent
+    assert request_span.name == "aidbox.request"
+    assert request_span.parent_id == parent.span_id
+    assert request_span.attributes == {
+        "http.method": "GET",
+        "http.path": "Patient/p1",
+        "http.response_size": len(
+            json.dumps(patient, ensure_ascii=False, separators=(",", ":")).encode()
+        ),
+    }
+    # Aidbox continues the trace of the request span
+    assert headers[0]["traceparent"] == request_span.traceparent
+    assert request_span.traceparent.startswith(f"00-{parent.trace_id}-")
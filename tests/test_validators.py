@@ -0,0 +1,79 @@
+import pytest
+from fhirpy.base.exceptions import OperationOutcome
+
+from aidbox_python_sdk.sdk import validate_request
+from aidbox_python_sdk.validators import create_request_validator
+
+SCHEMA = {
+    "type": "object",
+    "required": ["resource"],
+    "properties": {
+        "resource": {
+            "type": "object",
+            "required": ["name", "birthDate"],
+            "properties": {"name": {"type": "string"}, "birthDate": {"type": "string"}},
+        },
+    },
+}
+
+
+def _get_issues(request_validator, request):
+    with pytest.raises(OperationOutcome) as exc_info:
+        validate_request(request_validator, request)
+    return exc_info.value.resource["issue"]
+
+
+def test_jsonschema_validator_reports_all_errors():
+    request_validator = create_request_validator(SCHEMA)
+    issues = _get_issues(request_validator, {"resource": {"name": 1, "birthDate": 2}})
+
+    assert [issue["expression"] for issue in issues] == [["resource.name"], ["resource.birthDate"]]
+    assert issues[0]["diagnostics"] == "1 is not of type 'string'"
+
+
+def test_jsonschema_validator_stops_after_max_errors():
+    request_validator = create_request_validator(SCHEMA, max_errors=1)
+    issues = _get_issues(request_validator, {"resource": {"name": 1, "birthDate": 2}})
+
+    assert len(issues) == 1
+
+
+def test_validator_ignores_app_key():
+    request_validator = create_request_validator({**SCHEMA, "additionalProperties": False})
+    validate_request(
+        request_validator, {"resource": {"name": "a", "birthDate": "b"}, "app": object()}
+    )
+
+
+def test_fastjsonschema_validator_reports_first_error():
+    pytest.importorskip("fastjsonschema")
+    request_validator = create_request_validator(SCHEMA, backend="fastjsonschema")
+    issues = _get_issues(request_validator, {"resource": {"name": "a"}})
+
+    assert len(issues) == 1
+    assert issues[0]["expression"] == ["resource"]
+    # Messages are generated by fastjsonschema, they differ from jsonschema ones
+    assert issues[0]["diagnostics"].startswith("data.resource must contain")
+
+    validate_request(request_validator, {"resource": {"name": "a", "birthDate": "b"}})
+
+
+def test_fastjsonschema_validator_does_not_support_max_errors():
+    pytest.importorskip("fastjsonschema")
+    with pytest.raises(ValueError, match="request_validation_max_errors"):
+        create_request_validator(SCHEMA, backend="fastjsonschema", max_errors=5)
+
+
+def test_fastjsonschema_validator_does_not_support_draft_2020_12():
+    pytest.importorskip("fastjsonschema")
+    schema = {"$schema": "https://json-schema.org/draft/2020-12/schema", **SCHEMA}
+    with pytest.raises(ValueError, match="2020-12"):
+        create_request_validator(schema, backend="fastjsonschema")
+
+    schema = {"$schema": "http://json-schema.org/draft-07/schema#", **SCHEMA}
+    create_request_validator(schema, backend="fastjsonschema")
+
+
+def test_request_validator_backend_is_validated():
+    with pytest.raises(ValueError, match="Request validator must be one of"):
+        create_request_validator(SCHEMA, backend="unknown")